@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+from prefetch import MOSCOW, is_trading_time
+
+logger = logging.getLogger(__name__)
+
+ABOVE, BELOW, MOVE = 0, 1, 2
+KIND_LABELS = {ABOVE: 'выше', BELOW: 'ниже', MOVE: 'движение на'}
+
+# "SBER > 300", "SBER < 250", "SBER 5%"
+ALERT_RE = re.compile(r'^\s*([A-Za-z0-9]+)\s*([<>])?\s*(\d+(?:[.,]\d+)?)\s*(%)?\s*$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    ticker TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    threshold REAL NOT NULL,
+    base REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_user ON alerts (user_id);
+'''
+
+
+class Alert(NamedTuple):
+    id: int
+    user_id: int
+    chat_id: int
+    ticker: str
+    kind: int
+    threshold: float
+    base: float  # цена в момент создания: от неё считается движение в процентах
+    created: float
+
+    def describe(self):
+        if self.kind == MOVE:
+            return f'{self.ticker}: {KIND_LABELS[self.kind]} {self.threshold:g}% от {self.base:g}₽'
+        return f'{self.ticker}: {KIND_LABELS[self.kind]} {self.threshold:g}₽'
+
+
+def parse_alert(text):
+    """(тикер, вид, порог) из строки команды или None"""
+    match = ALERT_RE.match(text)
+    if match is None:
+        return None
+    ticker, sign, value, percent = match.groups()
+    threshold = float(value.replace(',', '.'))
+    if percent:
+        if sign or threshold <= 0:
+            return None
+        return ticker.upper(), MOVE, threshold
+    if not sign:
+        return None
+    return ticker.upper(), ABOVE if sign == '>' else BELOW, threshold
+
+
+def triggered(kinds, thresholds, bases, high, low):
+    """Маска сработавших уведомлений по максимуму и минимуму цены с прошлой проверки (для каждого уведомления свои)"""
+    import numpy as np
+    moved = np.maximum(high / bases - 1, 1 - low / bases) * 100
+    return np.where(kinds == ABOVE, high >= thresholds,
+                    np.where(kinds == BELOW, low <= thresholds, moved >= thresholds))
+
+
+class AlertStore:
+    """Уведомления о цене в SQLite; запросы выполняются в отдельном потоке"""
+
+    def __init__(self, path='alerts.sqlite3'):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alerts')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('ALERTS_DB_PATH', 'alerts.sqlite3'))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load(self):
+        return [Alert(*row) for row in self._conn.execute('SELECT * FROM alerts')]
+
+    def _insert(self, alert):
+        with self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO alerts (user_id, chat_id, ticker, kind, threshold, base, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                alert[1:]
+            )
+        return alert._replace(id=cursor.lastrowid)
+
+    def _delete(self, ids):
+        with self._conn:
+            self._conn.executemany('DELETE FROM alerts WHERE id = ?', [(alert_id,) for alert_id in ids])
+
+    async def load(self):
+        return await self._run(self._load)
+
+    async def insert(self, alert):
+        return await self._run(self._insert, alert)
+
+    async def delete(self, ids):
+        await self._run(self._delete, ids)
+
+    def close(self):
+        self._executor.submit(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+class AlertEngine:
+    """Проверка уведомлений: один запрос свечей на тикер за тик, сравнение со всеми порогами тикера разом"""
+
+    def __init__(self, store, quotes, max_per_user=20):
+        # quotes(context, ticker) -> сегодняшние минутные свечи тикера
+        self.store = store
+        self.quotes = quotes
+        self.max_per_user = max_per_user
+        self._by_ticker = defaultdict(dict)  # тикер -> {id: Alert}
+        self._arrays = {}  # тикер -> (ids, kinds, thresholds, bases, created), пересобирается после изменений
+        self._checked = {}  # тикер -> начало последней проверенной свечи
+
+    @classmethod
+    def from_env(cls, quotes):
+        return cls(AlertStore.from_env(), quotes, max_per_user=int(os.getenv('ALERTS_PER_USER', 20)))
+
+    async def load(self):
+        for alert in await self.store.load():
+            self._by_ticker[alert.ticker][alert.id] = alert
+
+    def __len__(self):
+        return sum(len(alerts) for alerts in self._by_ticker.values())
+
+    def user_alerts(self, user_id):
+        alerts = [alert for by_id in self._by_ticker.values() for alert in by_id.values() if alert.user_id == user_id]
+        return sorted(alerts, key=lambda alert: alert.id)
+
+    async def add(self, user_id, chat_id, ticker, kind, threshold, base):
+        if len(self.user_alerts(user_id)) >= self.max_per_user:
+            raise ValueError(f'Не больше {self.max_per_user} уведомлений на пользователя')
+        alert = await self.store.insert(Alert(None, user_id, chat_id, ticker, kind, threshold, base, time.time()))
+        self._by_ticker[ticker][alert.id] = alert
+        self._arrays.pop(ticker, None)
+        return alert
+
+    async def remove(self, alerts):
+        for alert in alerts:
+            self._by_ticker[alert.ticker].pop(alert.id, None)
+            self._arrays.pop(alert.ticker, None)
+            if not self._by_ticker[alert.ticker]:
+                del self._by_ticker[alert.ticker]
+                self._checked.pop(alert.ticker, None)
+        await self.store.delete([alert.id for alert in alerts])
+
+    def _ticker_arrays(self, ticker):
+        arrays = self._arrays.get(ticker)
+        if arrays is None:
+            import numpy as np
+            alerts = list(self._by_ticker[ticker].values())
+            arrays = self._arrays[ticker] = (
+                np.array([alert.id for alert in alerts], dtype=np.int64),
+                np.array([alert.kind for alert in alerts], dtype=np.int8),
+                np.array([alert.threshold for alert in alerts], dtype=float),
+                np.array([alert.base for alert in alerts], dtype=float),
+                # Время создания в тех же единицах, что и начало свечей MOEX: московское время без часового пояса
+                np.array([datetime.fromtimestamp(alert.created, MOSCOW).replace(tzinfo=None) for alert in alerts],
+                         dtype='datetime64[ns]'),
+            )
+        return arrays
+
+    def evaluate(self, ticker, data):
+        """Сработавшие уведомления тикера по свечам, появившимся с прошлой проверки"""
+        checked = self._checked.get(ticker)
+        # При первой проверке смотрим только последнюю свечу: более ранние движения были до запуска
+        window = data[data['begin'] >= checked] if checked is not None else data.tail(1)
+        self._checked[ticker] = data['begin'].iloc[-1]
+        if window.empty:
+            return []
+        import numpy as np
+        ids, kinds, thresholds, bases, created = self._ticker_arrays(ticker)
+        # Каждое уведомление видит только свечи, начавшиеся после его создания: иначе новое уведомление
+        # сработало бы на максимуме или минимуме, который был ещё до него
+        after = window['begin'].to_numpy(dtype='datetime64[ns]')[None, :] >= created[:, None]
+        high = np.where(after, window['high'].to_numpy(dtype=float)[None, :], -np.inf).max(axis=1)
+        low = np.where(after, window['low'].to_numpy(dtype=float)[None, :], np.inf).min(axis=1)
+        mask = triggered(kinds, thresholds, bases, high, low)
+        by_id = self._by_ticker[ticker]
+        return [by_id[alert_id] for alert_id in ids[mask]]
+
+    async def tick(self, context):
+        if not self._by_ticker or not is_trading_time():
+            return
+        tickers = list(self._by_ticker)
+        results = await asyncio.gather(*(self.quotes(context, ticker) for ticker in tickers), return_exceptions=True)
+        fired = []
+        for ticker, data in zip(tickers, results):
+            if isinstance(data, Exception):
+                logger.warning('Не удалось получить котировки %s: %s', ticker, data)
+                continue
+            if not data.empty:
+                fired.extend((alert, data['close'].iloc[-1]) for alert in self.evaluate(ticker, data))
+        if not fired:
+            return
+
+        # Уведомления одноразовые: удаляем до отправки, чтобы при ошибке сети не слать их повторно
+        await self.remove([alert for alert, _ in fired])
+        for alert, price in fired:
+            try:
+                await context.bot.send_message(alert.chat_id, f'🔔 {alert.describe()}\nТекущая цена: {price:g}₽')
+            except Exception:
+                logger.exception('Не удалось отправить уведомление %s', alert.id)
@@ -0,0 +1,229 @@
+"""Нагрузочный бенчмарк бота без сети: синтетические свечи вместо MOEX и поддельные обновления Telegram.
+
+Запуск: python -m benchmarks.load --users 10 100 1000 --chart-type line candles heiken-ashi
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+from itertools import count
+
+import numpy as np
+
+from benchmarks.startup import format_startup, measure_startup
+from benchmarks.synthetic import install_fake_moexalgo
+
+# Сценарии: пресет периода и интервал свечей
+SCENARIOS = {
+    '1min': ('1day', '1min'),
+    '1day': ('5years', '1d'),
+}
+TICKERS = ['SBER', 'GAZP', 'NVTK', 'LKOH', 'TATN', 'ROSN', 'GMKN', 'YDEX', 'MGNT', 'PLZL',
+           'CHMF', 'NLMK', 'SNGS', 'VTBR', 'ALRS', 'MTSS', 'AFLT', 'PHOR', 'POLY', 'IRAO']
+
+_ids = count(1)
+
+
+class FakeMessage:
+    """Сообщение Telegram: отправка графика возвращает настоящий telegram.Message с file_id"""
+
+    def __init__(self, user_id, upload_latency):
+        self.user_id = user_id
+        self.upload_latency = upload_latency / 1000
+
+    def _sent(self, file_id=None):
+        from telegram import Chat, Message, PhotoSize
+        photos = (PhotoSize(file_id, file_id, 1280, 600),) if file_id else ()
+        return Message(next(_ids), datetime.now(), Chat(self.user_id, Chat.PRIVATE), photo=photos)
+
+    async def _upload(self, media):
+        # Повторная отправка по file_id не передаёт файл заново
+        if isinstance(media, str):
+            return media
+        await asyncio.sleep(self.upload_latency)
+        return f'file-{next(_ids)}'
+
+    async def reply_text(self, text, **kwargs):
+        return self._sent()
+
+    async def reply_photo(self, photo, **kwargs):
+        return self._sent(await self._upload(photo))
+
+    async def reply_document(self, document, **kwargs):
+        await self._upload(document)
+        return self._sent()
+
+    async def edit_media(self, media, **kwargs):
+        return self._sent(await self._upload(media.media))
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, message):
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        pass
+
+
+class FakeUpdate:
+    def __init__(self, user_id, data, message):
+        self.callback_query = FakeCallbackQuery(data, message)
+        self.message = None
+        self.effective_message = message
+        self.effective_user = self.effective_chat = type('User', (), {'id': user_id})()
+
+
+class FakeContext:
+    def __init__(self, user_data, bot_data):
+        self.user_data = user_data
+        self.bot_data = bot_data
+
+
+class RssSampler:
+    """Пиковая резидентная память бота и процессов отрисовки (по /proc, иначе getrusage)"""
+
+    def __init__(self, pids, interval=0.05):
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0
+        self._page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def sample(self):
+        total = 0
+        for pid in [os.getpid(), *self.pids()]:
+            try:
+                with open(f'/proc/{pid}/statm') as statm:
+                    total += int(statm.read().split()[1]) * self._page
+            except OSError:
+                pass
+        if not total:
+            import resource
+            total = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.peak = max(self.peak, total)
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+
+async def user_session(main, bot_data, user_id, ticker, period, time_gap, chart_type, requests, upload_latency):
+    from session import UserSession
+    context = FakeContext(UserSession(ticker=ticker), bot_data)
+    message = FakeMessage(user_id, upload_latency)
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await main.handle_period(FakeUpdate(user_id, f'period_{period}', message), context)
+        await main.handle_time_gap(FakeUpdate(user_id, f'time_gap:{time_gap}', message), context)
+        if chart_type != 'line':
+            await main.handler_chart_type_change(FakeUpdate(user_id, f'set_chart_type:{chart_type}', message), context)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def run_scenario(main, render, args, scenario, chart_type, users):
+    # Свежие кеши и хранилище на каждый сценарий, общий только пул отрисовки
+    bot_data = {}
+    os.environ['CANDLE_STORE_PATH'] = os.path.join(args.workdir, f'candles-{scenario}-{chart_type}-{users}.sqlite3')
+    # По умолчанию бенчмарк меряет пропускную способность, а не лимит запросов на пользователя
+    os.environ['USER_RATE_PER_MIN'] = str(args.user_rate)
+    main.create_services(bot_data)
+    bot_data['render'] = render
+    render.metrics = bot_data['metrics']
+    period, time_gap = SCENARIOS[scenario]
+
+    sampler = RssSampler(lambda: list(render._executor._processes))
+    sampling = asyncio.create_task(sampler.run())
+    started = time.perf_counter()
+    tasks = []
+    for user_id in range(users):
+        ticker = TICKERS[user_id % args.tickers]
+        tasks.append(asyncio.create_task(user_session(
+            main, bot_data, user_id + 1, ticker, period, time_gap, chart_type, args.requests, args.upload_latency
+        )))
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    sampling.cancel()
+    sampler.sample()
+
+    bot_data['store'].close()
+    bot_data['moex'].shutdown()
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    latencies = np.array([value for result in results if not isinstance(result, BaseException) for value in result])
+    stages = bot_data['metrics'].stages
+    return {
+        'p50': np.percentile(latencies, 50) if len(latencies) else float('nan'),
+        'p99': np.percentile(latencies, 99) if len(latencies) else float('nan'),
+        'throughput': len(latencies) / elapsed,
+        'rss': sampler.peak,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'stages': {name: stages[name].sum / stages[name].count for name in ('fetch', 'render', 'encode') if name in stages},
+        'candle_hits': bot_data['candles'].stats()['hit_ratio'],
+        'chart_hits': bot_data['charts'].stats()['hit_ratio'],
+    }
+
+
+async def run(args):
+    install_fake_moexalgo(args.moex_latency / 1000)
+    import main
+    from render_pool import RenderPool
+
+    render = RenderPool(workers=args.render_workers or None, max_queue=args.render_queue)
+    await render.warm_up()
+    print(f'{"сценарий":<28} {"p50, мс":>9} {"p99, мс":>9} {"запр/с":>8} {"RSS, МБ":>8} {"ошибки":>7}  '
+          f'fetch/render/encode, мс  кеш свечей/графиков')
+    try:
+        for scenario in args.scenario:
+            for chart_type in args.chart_type:
+                for users in args.users:
+                    result = await run_scenario(main, render, args, scenario, chart_type, users)
+                    stages = '/'.join(f'{result["stages"].get(name, 0) * 1000:.0f}' for name in ('fetch', 'render', 'encode'))
+                    print(f'{f"{scenario} {chart_type} x{users}":<28} {result["p50"] * 1000:>9.0f} {result["p99"] * 1000:>9.0f} '
+                          f'{result["throughput"]:>8.1f} {result["rss"] / 2**20:>8.0f} {result["errors"]:>7}  '
+                          f'{stages:<24} {result["candle_hits"]:.0%}/{result["chart_hits"]:.0%}')
+                    if result['first_error'] is not None:
+                        print(f'  первая ошибка: {result["first_error"]!r}')
+    finally:
+        render.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--chart-type', nargs='+', default=['line', 'candles', 'heiken-ashi'])
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--requests', type=int, default=1, help='графиков на одного пользователя')
+    parser.add_argument('--rate', type=float, default=0, help='новых пользователей в секунду (0 — все сразу)')
+    parser.add_argument('--tickers', type=int, default=10, help=f'сколько разных тикеров запрашивают (до {len(TICKERS)})')
+    parser.add_argument('--moex-latency', type=float, default=0, help='задержка ответа MOEX, мс')
+    parser.add_argument('--upload-latency', type=float, default=0, help='задержка отправки файла в Telegram, мс')
+    parser.add_argument('--render-workers', type=int, default=0)
+    parser.add_argument('--render-queue', type=int, default=100_000)
+    parser.add_argument('--user-rate', type=float, default=0, help='лимит дорогих запросов пользователя в минуту (0 — без лимита)')
+    parser.add_argument('--startup-runs', type=int, default=3, help='замеров холодного старта (0 — не измерять)')
+    args = parser.parse_args()
+    args.tickers = min(args.tickers, len(TICKERS))
+    if args.startup_runs:
+        print(format_startup(measure_startup(args.startup_runs)))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Проверка пирамиды свечей: недели и месяцы, собранные хранилищем из дневных свечей, совпадают с самими днями.
+
+Запуск: python -m benchmarks.pyramid_check
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_candles
+from candle_store import CandleStore
+
+START, END = date(2024, 1, 1), date(2024, 3, 31)
+# Правила pandas для ожидаемых свечей: неделя с понедельника, месяц с первого числа
+EXPECTED_RULES = {'1w': 'W-MON', '1m': 'MS'}
+
+
+def expected_bars(daily, interval):
+    grouped = daily.resample(EXPECTED_RULES[interval], on='begin', label='left', closed='left')
+    return pd.DataFrame({
+        'open': grouped['open'].first(),
+        'close': grouped['close'].last(),
+        'volume': grouped['volume'].sum(),
+    }).dropna().reset_index()
+
+
+def check(store, daily, interval):
+    """Расхождения производных свечей interval с агрегацией дневных свечей"""
+    derived = store.read('TEST', interval, START, END).set_index('begin')
+    errors = []
+    for row in expected_bars(daily, interval).itertuples():
+        # Неполные периоды на краях диапазона хранилище не строит
+        if row.begin not in derived.index:
+            continue
+        bar = derived.loc[row.begin]
+        for column in ('open', 'close', 'volume'):
+            if abs(bar[column] - getattr(row, column)) > 1e-6:
+                errors.append(f'{interval} {row.begin:%Y-%m-%d} {column}: {bar[column]} вместо {getattr(row, column)}')
+    if derived.empty:
+        errors.append(f'{interval}: производные свечи не построены')
+    return errors
+
+
+def main():
+    daily = synthetic_candles((END - START).days + 1, interval='1d', start=START.isoformat())
+    with tempfile.TemporaryDirectory() as workdir:
+        store = CandleStore(os.path.join(workdir, 'candles.sqlite3'))
+        try:
+            store.write('TEST', '1d', daily, (START, END))
+            errors = check(store, daily, '1w') + check(store, daily, '1m')
+        finally:
+            store.close()
+    for error in errors:
+        print(error)
+    print('ошибок нет' if not errors else f'ошибок: {len(errors)}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Микробенчмарк отрисовки одного графика: прежний pyplot-вариант против ChartRenderer.
+
+Запуск: python -m benchmarks.render --points 250 1000 5000 --repeat 10
+"""
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+from io import BytesIO
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import pandas as pd
+from mplfinance.original_flavor import candlestick_ohlc
+
+from benchmarks.synthetic import synthetic_candles
+from plotting import ChartRenderer, converter_to_heikin_ashi_dataframe, format_days_human
+
+
+def legacy_paint_plot(df, ticker, start_date, end_date, date_type, date_delta, chart_type='line'):
+    """paint_plot до перехода на ChartRenderer: стиль, шрифт и фигура создаются на каждый вызов"""
+    part_header_time_gap = f'{start_date:%d.%m.%y} - {end_date:%d.%m.%y}'
+    x_date_format = '%d.%m %H:%M' if date_delta <= 3 else '%d.%m.%y' if date_delta <= 90 else '%b %Y'
+
+    df = df.assign(begin=pd.to_datetime(df['begin']), x=range(len(df)))
+
+    plt.style.use('seaborn-v0_8-darkgrid')
+    plt.rcParams['font.family'] = 'Times New Roman'
+    fig, ax = plt.subplots(figsize=(15, 7))
+
+    if chart_type == 'line':
+        ax.plot(df['x'].values, df['open'].values, linewidth=2, color="#3d69b7", label='Цена открытия')
+        ax.legend(fontsize=12)
+    else:
+        quotes_df = converter_to_heikin_ashi_dataframe(df) if chart_type == 'heiken-ashi' else df
+        quotes_df = quotes_df.assign(x=range(len(quotes_df)))
+        quotes = quotes_df[['x', 'open', 'high', 'low', 'close']].astype(float).values
+        candlestick_ohlc(ax, quotes, width=0.6, colorup='green', colordown='red', alpha=0.8)
+
+    ax.set_title(f'{ticker} | {part_header_time_gap} | {format_days_human(date_delta)} ({len(df)} точек) | Последняя цена: {df.iloc[-1]["close"]:.1f}₽',
+                 fontsize=20, pad=20, fontweight='bold')
+    ax.set_xlabel('Дата', fontsize=16)
+    ax.set_ylabel('Цена (₽)', fontsize=16)
+    step_x = max(len(df) // 10, 1)
+    ax.grid(True, alpha=0.4)
+    ax.set_xticks(df['x'][::step_x])
+    ax.set_xticklabels(df['begin'].dt.strftime(x_date_format)[::step_x], rotation=45)
+    plt.tight_layout()
+
+    buf = BytesIO()
+    plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
+    buf.seek(0)
+    plt.close()
+    return buf
+
+
+def measure(func, df, chart_type, repeat):
+    end_date = date(2024, 1, 1)
+    start_date = end_date - timedelta(days=len(df))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(df, 'SBER', start_date, end_date, '1d', len(df), chart_type)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, nargs='+', default=[250, 1000, 5000])
+    parser.add_argument('--chart-type', nargs='+', default=['line', 'candles', 'heiken-ashi'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    renderer = ChartRenderer()
+    print(f'ChartRenderer init: {(time.perf_counter() - started) * 1000:.0f} мс')
+    print(f'{"тип":<12}{"точек":>8}{"до, мс":>12}{"после, мс":>12}{"ускорение":>12}')
+
+    for chart_type in args.chart_type:
+        for points in args.points:
+            df = synthetic_candles(points)
+            # Первый вызов прогревает кеши matplotlib для обоих вариантов
+            legacy_paint_plot(df, 'SBER', date(2024, 1, 1), date(2024, 1, 1), '1d', 1, chart_type)
+            renderer.render(df, 'SBER', date(2024, 1, 1), date(2024, 1, 1), '1d', 1, chart_type)
+            before = statistics.median(measure(legacy_paint_plot, df, chart_type, args.repeat))
+            after = statistics.median(measure(renderer.render, df, chart_type, args.repeat))
+            print(f'{chart_type:<12}{points:>8}{before * 1000:>12.0f}{after * 1000:>12.0f}{before / after:>11.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Холодный старт бота: время до ответа на /start и до окончания фонового прогрева.
+
+Запуск: python -m benchmarks.startup --runs 5
+Каждый замер выполняется в отдельном процессе: модули загружаются один раз на процесс.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Эти модули не должны загружаться до ответа на /start
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'mplfinance', 'moexalgo')
+
+
+class StartMessage:
+    async def reply_text(self, text, **kwargs):
+        return None
+
+
+class StartUpdate:
+    message = StartMessage()
+
+
+class StartContext:
+    def __init__(self, user_data):
+        self.user_data = user_data
+
+
+async def child(started):
+    import main
+    from session import UserSession
+    imported = time.perf_counter()
+    bot_data = {}
+    main.create_services(bot_data)
+    await main.start(StartUpdate(), StartContext(UserSession()))
+    ready = time.perf_counter()
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    # Фоновый прогрев бота: библиотеки данных в потоке и процесс отрисовки
+    from render_pool import RenderPool
+    render = RenderPool(workers=1)
+    warm_started = time.perf_counter()
+    imports = [name for name in main.BACKGROUND_IMPORTS if importlib.util.find_spec(name) is not None]
+    await asyncio.gather(render.warm_up(), asyncio.to_thread(lambda: [importlib.import_module(name) for name in imports]))
+    warmed = time.perf_counter()
+    render.shutdown()
+    bot_data['store'].close()
+    bot_data['alerts'].store.close()
+    bot_data['moex'].shutdown()
+    return {
+        'import': imported - started,
+        'ready': ready - started,
+        'warm_up': warmed - warm_started,
+        'heavy': heavy,
+    }
+
+
+def measure_startup(runs=3):
+    """Медианы замеров холодного старта, каждый в новом процессе интерпретатора"""
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(os.environ,
+                       CANDLE_STORE_PATH=os.path.join(workdir, 'candles.sqlite3'),
+                       ALERTS_DB_PATH=os.path.join(workdir, 'alerts.sqlite3'))
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child'], cwd=ROOT, env=env,
+                                    stdout=subprocess.PIPE, text=True, check=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            result['process'] = time.perf_counter() - started
+            results.append(result)
+    summary = {name: statistics.median(result[name] for result in results) for name in ('import', 'ready', 'warm_up', 'process')}
+    summary['heavy'] = sorted({name for result in results for name in result['heavy']})
+    return summary
+
+
+def format_startup(summary):
+    heavy = ', '.join(summary['heavy']) or 'нет'
+    return (f'Холодный старт: импорт {summary["import"] * 1000:.0f} мс, ответ на /start через {summary["ready"] * 1000:.0f} мс, '
+            f'фоновый прогрев {summary["warm_up"] * 1000:.0f} мс, процесс целиком {summary["process"] * 1000:.0f} мс; '
+            f'тяжёлые модули до /start: {heavy}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        # Сам бенчмарк ничего тяжёлого не импортирует; запуск интерпретатора учтён в замере "процесс целиком"
+        print(json.dumps(asyncio.run(child(time.perf_counter()))))
+        return
+    print(format_startup(measure_startup(args.runs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import sys
+import time
+import types
+import zlib
+
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = {
+    '1min': '1min',
+    '10min': '10min',
+    '1h': '1h',
+    '1d': '1D',
+    '1w': 'W-MON',
+    '1m': 'MS',
+}
+
+
+def synthetic_candles(n, interval='1d', seed=0, start='2020-01-01', price=250.0):
+    """Детерминированные свечи в формате moexalgo (случайное блуждание цены)"""
+    rng = np.random.default_rng(seed)
+    begin = pd.date_range(start, periods=n, freq=FREQUENCIES[interval])
+    close = price * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.r_[price, close[:-1]][:n]
+    spread = np.abs(rng.normal(0, 0.005, n)) * close
+    volume = rng.integers(1_000, 100_000, n).astype(float)
+    return pd.DataFrame({
+        'open': open_,
+        'close': close,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'value': volume * close,
+        'volume': volume,
+        'begin': begin,
+        'end': begin,
+    })
+
+
+INTRADAY = {'1min', '10min', '1h'}
+
+
+class SyntheticTicker:
+    """Замена moexalgo.Ticker: свечи за любой период без сети, одинаковые при повторных запросах"""
+
+    # Искусственная задержка ответа биржи, сек (блокирует поток, как настоящий HTTP-запрос)
+    latency = 0.0
+
+    def __init__(self, ticker, *args, **kwargs):
+        self.ticker = ticker
+
+    def candles(self, start, end, period='1d', **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        begin = pd.date_range(pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1),
+                              freq=FREQUENCIES[period], inclusive='left')
+        if period in INTRADAY:
+            # Только основная сессия, но без выходных: иначе результат бенчмарка зависел бы от дня запуска
+            begin = begin[(begin.hour >= 10) & (begin.hour < 19)]
+        seed = zlib.crc32(f'{self.ticker}:{period}:{start}'.encode())
+        df = synthetic_candles(len(begin), interval=period, seed=seed, price=50 + seed % 500)
+        return df.assign(begin=begin, end=begin)
+
+
+def install_fake_moexalgo(latency=0.0):
+    """Подменяет moexalgo в sys.modules; вызывать до импорта main и moex_client"""
+    SyntheticTicker.latency = latency
+    module = types.ModuleType('moexalgo')
+    module.Ticker = SyntheticTicker
+    sys.modules['moexalgo'] = module
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+# Время жизни записей по интервалу свечей (сек): внутридневные данные быстро устаревают
+TTL_BY_INTERVAL = {
+    '1min': 60,
+    '10min': 5 * 60,
+    '1h': 15 * 60,
+    '1d': 3 * 3600,
+    '1w': 6 * 3600,
+    '1m': 12 * 3600,
+}
+
+
+class CandleCache:
+    """Общий для всех пользователей LRU-кеш свечей по (тикер, интервал, начало, конец)"""
+
+    def __init__(self, max_bytes=256 * 2**20, ttl_by_interval=None):
+        self.max_bytes = max_bytes
+        self.ttl_by_interval = ttl_by_interval or TTL_BY_INTERVAL
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, df)
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_bytes=int(os.getenv('CANDLE_CACHE_MB', 256)) * 2**20)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, df = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return df
+
+    def peek(self, ticker, interval, start, end):
+        """Свечи из кеша без учёта в статистике и без загрузки: по ним оценивается стоимость запроса"""
+        return self._lookup((ticker, interval, start, end))
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def put(self, ticker, interval, start, end, df, ttl=None):
+        key = (ticker, interval, start, end)
+        if key in self._entries:
+            self._drop(key)
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl or self.ttl_by_interval.get(interval, 300))
+        self._entries[key] = (expires_at, size, df)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    async def get(self, ticker, interval, start, end, fetch, refresh=False, priority=0, ttl=None):
+        """Возвращает свечи из кеша; при промахе вызывает fetch() один раз на все одновременные запросы.
+        refresh=True загружает данные заново, не дожидаясь истечения записи (прогрев кеша),
+        ttl заменяет срок жизни записи по умолчанию для интервала.
+        priority — приоритет загрузки (меньше — срочнее): к менее срочной загрузке запрос не присоединяется,
+        иначе запрос пользователя ждал бы прогрев, который стоит в очереди за всеми остальными запросами"""
+        key = (ticker, interval, start, end)
+        df = None if refresh else self._lookup(key)
+        if df is not None:
+            self.hits += 1
+            return df
+
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[1] <= priority:
+            task = inflight[0]
+            self.coalesced += not refresh
+        else:
+            self.misses += not refresh
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = (task, priority)
+
+            def done(t):
+                if self._inflight.get(key, (None,))[0] is t:
+                    del self._inflight[key]
+                if not t.cancelled() and t.exception() is None:
+                    self.put(ticker, interval, start, end, t.result(), ttl)
+
+            task.add_done_callback(done)
+        # shield: отмена одного ожидающего не должна прерывать загрузку для остальных
+        return await asyncio.shield(task)
+
+    def stats(self):
+        total = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_ratio': (self.hits + self.coalesced) / total if total else 0.0,
+        }
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import repeat
+
+from pyramid import coarser, period_end, period_start, resample_ohlc, whole_periods
+
+COLUMNS = ['open', 'close', 'high', 'low', 'value', 'volume', 'begin', 'end']
+SELECT_COLUMNS = ', '.join(f'"{c}"' for c in COLUMNS)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS candles (
+    ticker TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    "begin" TEXT NOT NULL,
+    open REAL, close REAL, high REAL, low REAL, value REAL, volume REAL,
+    "end" TEXT,
+    PRIMARY KEY (ticker, interval, "begin")
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS spans (
+    ticker TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    start TEXT NOT NULL,
+    "end" TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spans_key ON spans (ticker, interval);
+'''
+
+
+def complete_until(interval, today):
+    """Последний день, данные по которому уже не изменятся (текущая свеча ещё формируется)"""
+    if interval == '1w':
+        return today - timedelta(days=today.weekday() + 1)
+    if interval == '1m':
+        return today.replace(day=1) - timedelta(days=1)
+    return today - timedelta(days=1)
+
+
+def missing_ranges(spans, start, end):
+    """Участки [start, end], не покрытые отсортированным списком загруженных отрезков"""
+    gaps = []
+    cursor = start
+    for span_start, span_end in spans:
+        if span_end < cursor:
+            continue
+        if span_start > end:
+            break
+        if span_start > cursor:
+            gaps.append((cursor, span_start - timedelta(days=1)))
+        cursor = span_end + timedelta(days=1)
+        if cursor > end:
+            return gaps
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def merge_spans(spans):
+    merged = []
+    for span_start, span_end in sorted(spans):
+        if merged and span_start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+        else:
+            merged.append((span_start, span_end))
+    return merged
+
+
+class CandleStore:
+    """Хранилище свечей в SQLite по (тикер, интервал): с биржи догружаются только недостающие участки.
+
+    Свечи хранятся пирамидой: каждый записанный участок агрегируется в более крупные интервалы
+    (1min -> 10min -> 1h -> 1d, из дней — 1w и 1m), поэтому крупные свечи за уже загруженный период не запрашиваются с биржи.
+    """
+
+    def __init__(self, path='candles.sqlite3'):
+        # Одно соединение и один поток: все обращения к базе выполняются последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='candle-store')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._locks = {}  # ключ блокировки -> [lock, число ожидающих и работающих]
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('CANDLE_STORE_PATH', 'candles.sqlite3'))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def spans(self, ticker, interval):
+        rows = self._conn.execute(
+            'SELECT start, "end" FROM spans WHERE ticker = ? AND interval = ? ORDER BY start',
+            (ticker, interval)
+        ).fetchall()
+        return [(date.fromisoformat(s), date.fromisoformat(e)) for s, e in rows]
+
+    def write(self, ticker, interval, df, span=None):
+        import pandas as pd  # импортируется в потоке хранилища при первой записи, а не при старте бота
+        with self._conn:
+            if not df.empty:
+                begin = pd.to_datetime(df['begin']).dt.strftime('%Y-%m-%d %H:%M:%S')
+                end = pd.to_datetime(df['end']).dt.strftime('%Y-%m-%d %H:%M:%S')
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    zip(repeat(ticker), repeat(interval), begin,
+                        df['open'].tolist(), df['close'].tolist(), df['high'].tolist(), df['low'].tolist(),
+                        df['value'].tolist(), df['volume'].tolist(), end)
+                )
+            if span is not None:
+                spans = merge_spans(self.spans(ticker, interval) + [span])
+                self._conn.execute('DELETE FROM spans WHERE ticker = ? AND interval = ?', (ticker, interval))
+                self._conn.executemany(
+                    'INSERT INTO spans VALUES (?, ?, ?, ?)',
+                    [(ticker, interval, s.isoformat(), e.isoformat()) for s, e in spans]
+                )
+        if span is not None:
+            self._propagate(ticker, interval, span, spans)
+
+    def _propagate(self, ticker, interval, span, spans):
+        """Пересчитывает более крупные уровни пирамиды для периодов, затронутых записанным участком"""
+        for target in coarser(interval):
+            self._derive(ticker, interval, target, span, spans)
+
+    def _derive(self, ticker, interval, target, span, spans):
+        # Крупная свеча достоверна, только если мелкие свечи загружены за весь её период и он уже завершён
+        covering = next((s, e) for s, e in spans if s <= span[0] and span[1] <= e)
+        periods = whole_periods(target, covering[0], min(covering[1], complete_until(target, date.today())))
+        if periods is None:
+            return
+        start = max(periods[0], period_start(target, span[0]))
+        end = min(periods[1], period_end(target, span[1]))
+        if start > end:
+            return
+        import pandas as pd
+        finer = self.read(ticker, interval, start, end)
+        if finer.empty:
+            # Нет мелких свечей (например, у биржи нет такой глубокой истории) — не помечаем период пустым
+            return
+        first_day = finer['begin'].iloc[0].date()
+        if first_day > start:
+            start = first_day if period_start(target, first_day) == first_day else period_end(target, first_day) + timedelta(days=1)
+            if start > end:
+                return
+        bars = resample_ohlc(finer, target)
+        self.write(ticker, target, bars[bars['begin'] >= pd.Timestamp(start)], (start, end))
+
+    def read(self, ticker, interval, start, end):
+        import pandas as pd
+        df = pd.read_sql_query(
+            f'SELECT {SELECT_COLUMNS} FROM candles '
+            'WHERE ticker = ? AND interval = ? AND "begin" >= ? AND "begin" < ? ORDER BY "begin"',
+            self._conn,
+            params=(ticker, interval, start.isoformat(), (end + timedelta(days=1)).isoformat())
+        )
+        df['begin'] = pd.to_datetime(df['begin'])
+        df['end'] = pd.to_datetime(df['end'])
+        return df
+
+    async def get(self, ticker, interval, start, end, fetch, lock_key=None):
+        """Свечи за [start, end]; fetch(start, end) вызывается только для отсутствующих участков.
+        lock_key позволяет параллельно загружать непересекающиеся части одного ряда"""
+        key = lock_key or (ticker, interval)
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                spans = await self._run(self.spans, ticker, interval)
+                complete = complete_until(interval, date.today())
+                for gap_start, gap_end in missing_ranges(spans, start, end):
+                    df = await fetch(gap_start, gap_end)
+                    # Незавершённый хвост (сегодняшние свечи) не помечаем загруженным — он будет догружен снова
+                    span = (gap_start, min(gap_end, complete)) if gap_start <= complete else None
+                    await self._run(self.write, ticker, interval, df, span)
+                return await self._run(self.read, ticker, interval, start, end)
+        finally:
+            # Блокировки частей потоковой загрузки уникальны: без удаления их число росло бы с каждым графиком
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def close(self):
+        self._executor.submit(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from candle_cache import TTL_BY_INTERVAL
+
+# График за завершившийся период уже не изменится
+HISTORICAL_TTL = 24 * 3600
+# Имена файлов, которые кеш сам пишет на диск (ключ — sha256): только их он и удаляет
+SPILL_NAME_RE = re.compile(r'[0-9a-f]{64}\.png')
+
+
+def chart_ttl(interval, end_date):
+    if end_date < date.today() - timedelta(days=1):
+        return HISTORICAL_TTL
+    return TTL_BY_INTERVAL.get(interval, 300)
+
+
+class ChartCache:
+    """Общий кеш готовых графиков: PNG в памяти (LRU с вытеснением на диск) и file_id после первой загрузки в Telegram"""
+
+    def __init__(self, max_bytes=64 * 2**20, spill_dir=None, spill_max_bytes=512 * 2**20, max_entries=10_000):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self.spill_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight = {}  # key -> задача отрисовки
+        self._meta = OrderedDict()  # key -> [expires_at, file_id]
+        self._png = OrderedDict()  # key -> bytes
+        self._spilled = OrderedDict()  # key -> размер файла
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Метаданные хранятся только в памяти, поэтому файлы прошлого запуска не нужны.
+            # Чужие файлы в каталоге не трогаем: CHART_CACHE_DIR может указывать на общий каталог
+            for name in os.listdir(spill_dir):
+                if SPILL_NAME_RE.fullmatch(name):
+                    os.remove(os.path.join(spill_dir, name))
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.getenv('CHART_CACHE_MB', 64)) * 2**20,
+            spill_dir=os.getenv('CHART_CACHE_DIR') or None,
+            spill_max_bytes=int(os.getenv('CHART_CACHE_DISK_MB', 512)) * 2**20,
+        )
+
+    @staticmethod
+    def key(ticker, interval, start_date, end_date, chart_type, settings=()):
+        raw = repr((ticker, interval, str(start_date), str(end_date), chart_type, tuple(settings)))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.png')
+
+    def _forget(self, key):
+        self._meta.pop(key, None)
+        png = self._png.pop(key, None)
+        if png is not None:
+            self.size -= len(png)
+        size = self._spilled.pop(key, None)
+        if size is not None:
+            self.spill_size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _spill(self, key, png):
+        if not self.spill_dir or len(png) > self.spill_max_bytes:
+            return
+        with open(self._path(key), 'wb') as f:
+            f.write(png)
+        self._spilled[key] = len(png)
+        self.spill_size += len(png)
+        while self.spill_size > self.spill_max_bytes:
+            old_key, size = self._spilled.popitem(last=False)
+            self.spill_size -= size
+            os.remove(self._path(old_key))
+
+    def get(self, key):
+        """(file_id, png) или None; file_id есть, если график уже загружался в Telegram"""
+        meta = self._meta.get(key)
+        if meta is None or meta[0] < time.monotonic():
+            if meta is not None:
+                self._forget(key)
+            self.misses += 1
+            return None
+        file_id = meta[1]
+        png = self._png.get(key)
+        if png is not None:
+            self._png.move_to_end(key)
+        elif key in self._spilled:
+            with open(self._path(key), 'rb') as f:
+                png = f.read()
+        elif file_id is None:
+            self._forget(key)
+            self.misses += 1
+            return None
+        self._meta.move_to_end(key)
+        self.hits += 1
+        return file_id, png
+
+    def peek(self, key):
+        """Есть ли готовый график (без учёта в статистике)"""
+        meta = self._meta.get(key)
+        if meta is None or meta[0] < time.monotonic():
+            return False
+        return meta[1] is not None or key in self._png or key in self._spilled
+
+    async def render(self, key, draw, ttl, priority=0):
+        """PNG нового графика: draw() вызывается один раз на все одновременные запросы одного и того же графика.
+        К менее срочной отрисовке (priority больше) запрос не присоединяется — как и в CandleCache.get"""
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[1] <= priority:
+            task = inflight[0]
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(draw())
+            self._inflight[key] = (task, priority)
+
+            def done(t):
+                if self._inflight.get(key, (None,))[0] is t:
+                    del self._inflight[key]
+                if not t.cancelled() and t.exception() is None:
+                    self.put(key, t.result(), ttl)
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def put(self, key, png, ttl):
+        self._forget(key)
+        self._meta[key] = [time.monotonic() + ttl, None]
+        while len(self._meta) > self.max_entries:
+            self._forget(next(iter(self._meta)))
+        if len(png) > self.max_bytes:
+            self._spill(key, png)
+            return
+        self._png[key] = png
+        self.size += len(png)
+        while self.size > self.max_bytes:
+            old_key, old_png = self._png.popitem(last=False)
+            self.size -= len(old_png)
+            self._spill(old_key, old_png)
+
+    def set_file_id(self, key, file_id):
+        meta = self._meta.get(key)
+        if meta is not None:
+            meta[1] = file_id
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._meta),
+            'bytes': self.size,
+            'spill_bytes': self.spill_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            # Присоединившиеся к уже идущей отрисовке учтены в misses, но график для них не рисуется заново
+            'hit_ratio': (self.hits + self.coalesced) / total if total else 0.0,
+        }
@@ -0,0 +1,30 @@
+import re
+
+# Больше линий на одном графике уже не различить
+MAX_COMPARE_TICKERS = 5
+
+
+def parse_tickers(text):
+    """Тикеры из строки вида "SBER, GAZP NVTK" без повторов, в порядке ввода"""
+    tickers = []
+    for ticker in re.split(r'[\s,;]+', text.strip().upper()):
+        if ticker and ticker not in tickers:
+            tickers.append(ticker)
+    return tickers
+
+
+def align_returns(frames):
+    """Доходность бумаг от начала общего периода, %, на общей шкале времени.
+
+    frames — {тикер: свечи}. Ряды объединяются по begin (хеш-соединение индексов в pd.concat),
+    пропуски заполняются последней ценой: у бумаг могут отличаться торговые дни и минуты без сделок.
+    """
+    import pandas as pd
+    closes = pd.concat(
+        [df.set_index('begin')['close'].rename(ticker) for ticker, df in frames.items()],
+        axis=1, join='outer', sort=True,
+    ).ffill().dropna()
+    if closes.empty:
+        return closes.reset_index()
+    returns = (closes / closes.iloc[0] - 1) * 100
+    return returns.rename_axis('begin').reset_index()
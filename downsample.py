@@ -0,0 +1,78 @@
+# Больше точек на графике шириной 15 дюймов всё равно не различить
+LINE_MAX_POINTS = 1500
+CANDLE_MAX_POINTS = 200
+
+
+def lttb(x, y, threshold):
+    """Индексы точек, выбранных алгоритмом Largest-Triangle-Three-Buckets"""
+    import numpy as np
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Границы корзин для промежуточных точек: первая и последняя точки сохраняются всегда
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def aggregate_ohlc(df, max_points):
+    """Склеивает соседние свечи в группы так, чтобы их осталось не больше max_points"""
+    import numpy as np
+    import pandas as pd
+    n = len(df)
+    if n <= max_points:
+        return df
+
+    size = -(-n // max_points)
+    starts = np.arange(0, n, size)
+    ends = np.r_[starts[1:], n] - 1
+
+    columns = {
+        'open': df['open'].values[starts],
+        'close': df['close'].values[ends],
+        'high': np.maximum.reduceat(df['high'].values, starts),
+        'low': np.minimum.reduceat(df['low'].values, starts),
+    }
+    for name in ('value', 'volume'):
+        if name in df:
+            columns[name] = np.add.reduceat(df[name].values, starts)
+    columns['begin'] = df['begin'].values[starts]
+    if 'end' in df:
+        columns['end'] = df['end'].values[ends]
+    return pd.DataFrame(columns)
+
+
+def downsample(df, chart_type, line_points=LINE_MAX_POINTS, candle_points=CANDLE_MAX_POINTS):
+    """Прореживает ряд перед отрисовкой: LTTB для линии, агрегация OHLC для свечей и Хейкен-Аши"""
+    # numpy и pandas импортируются при первом графике (или фоновым прогревом), а не при старте бота
+    import numpy as np
+    if chart_type == 'compare':
+        # Каждая линия сравнения прореживается отдельно, на графике — объединение выбранных точек
+        series = [name for name in df.columns if name not in ('begin', 'x')]
+        if len(df) <= line_points:
+            return df
+        x = np.arange(len(df))
+        indices = np.unique(np.concatenate([lttb(x, df[name].values, line_points // len(series)) for name in series]))
+        return df.iloc[indices].assign(x=indices).reset_index(drop=True)
+    if chart_type == 'line':
+        if len(df) <= line_points:
+            return df
+        indices = lttb(np.arange(len(df)), df['open'].values, line_points)
+        # x сохраняет исходные позиции, чтобы расстояния между точками не искажались
+        return df.iloc[indices].assign(x=indices).reset_index(drop=True)
+    return aggregate_ohlc(df, candle_points)
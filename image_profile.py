@@ -0,0 +1,30 @@
+import os
+from typing import NamedTuple
+
+
+class OutputProfile(NamedTuple):
+    """Параметры итогового изображения; входят в ключ кеша графиков"""
+    # Ширина в пикселях: Telegram всё равно уменьшает фото примерно до 1280 px. 0 — DPI фигуры как есть
+    width: int = 1280
+    format: str = 'png'  # png или webp
+    # Размер палитры PNG: графику хватает 256 цветов, а файл становится в несколько раз меньше. 0 — без палитры
+    colors: int = 256
+    compression: int = 6  # уровень сжатия PNG (0–9)
+    quality: int = 85  # качество WebP (0–100)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            width=int(os.getenv('IMAGE_WIDTH', 1280)),
+            format=os.getenv('IMAGE_FORMAT', 'png'),
+            colors=int(os.getenv('IMAGE_COLORS', 256)),
+            compression=int(os.getenv('IMAGE_COMPRESSION', 6)),
+            quality=int(os.getenv('IMAGE_QUALITY', 85)),
+        )
+
+
+# Полноразмерный график для отправки документом: исходные 300 DPI без палитры
+FULL_RESOLUTION = OutputProfile(width=0, colors=0)
+
+# Миниатюра для инлайн-ответов: рисуется и загружается в Telegram быстрее обычного графика
+THUMBNAIL = OutputProfile(width=480)
@@ -0,0 +1,126 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def as_array(values):
+    """Непрерывный float64-массив; для колонки DataFrame нужного типа копия не создаётся"""
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def _recurrence_loop(a, b, y0):
+    out = np.empty(len(b))
+    prev = y0
+    for i in range(len(b)):
+        prev = a * prev + b[i]
+        out[i] = prev
+    return out
+
+
+_recurrence_compiled = njit(cache=True)(_recurrence_loop) if njit is not None else None
+
+
+def linear_recurrence(a, b, y0):
+    """Решение y[i] = a * y[i-1] + b[i] при y[-1] = y0 для 0 <= a <= 1.
+
+    Без numba рекуррентность раскрывается в y[j] = a^(j+1) * (y0 + sum_k b[k] * a^-(k+1))
+    и считается накопительной суммой (np.add.accumulate) по блокам, в которых a^-k не переполняется.
+    """
+    b = as_array(b)
+    n = len(b)
+    if n == 0 or a == 0:
+        return b.copy()
+    if _recurrence_compiled is not None:
+        return _recurrence_compiled(a, b, y0)
+
+    block = n if a == 1 else max(1, min(n, int(50 / -np.log10(a))))
+    steps = np.arange(1, block + 1)
+    powers = a ** steps
+    inverse_powers = a ** -steps.astype(np.float64)
+
+    out = np.empty(n)
+    prev = y0
+    for start in range(0, n, block):
+        chunk = b[start:start + block]
+        m = len(chunk)
+        out[start:start + m] = powers[:m] * (prev + np.add.accumulate(chunk * inverse_powers[:m]))
+        prev = out[start + m - 1]
+    return out
+
+
+def heikin_ashi(open_, high, low, close):
+    """Свечи Хейкен-Аши: (open, high, low, close)"""
+    open_, high, low, close = as_array(open_), as_array(high), as_array(low), as_array(close)
+    ha_close = (open_ + high + low + close) / 4
+    ha_open = np.empty(len(close))
+    if len(close):
+        ha_open[0] = (open_[0] + close[0]) / 2
+        # ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2
+        ha_open[1:] = linear_recurrence(0.5, ha_close[:-1] / 2, ha_open[0])
+    ha_high = np.maximum(high, np.maximum(ha_open, ha_close))
+    ha_low = np.minimum(low, np.minimum(ha_open, ha_close))
+    return ha_open, ha_high, ha_low, ha_close
+
+
+def sma(values, n):
+    values = as_array(values)
+    out = np.full(len(values), np.nan)
+    if len(values) >= n:
+        csum = np.cumsum(values)
+        out[n - 1] = csum[n - 1]
+        out[n:] = csum[n:] - csum[:-n]
+        out[n - 1:] /= n
+    return out
+
+
+def ema(values, n):
+    values = as_array(values)
+    out = np.empty(len(values))
+    if len(values):
+        alpha = 2 / (n + 1)
+        out[0] = values[0]
+        out[1:] = linear_recurrence(1 - alpha, alpha * values[1:], values[0])
+    return out
+
+
+def _wilder(values, n):
+    """Сглаживание Уайлдера: первое значение — среднее за n точек, далее EMA с alpha = 1/n"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= n:
+        out[n - 1] = values[:n].mean()
+        out[n:] = linear_recurrence((n - 1) / n, values[n:] / n, out[n - 1])
+    return out
+
+
+def rsi(close, n=14):
+    close = as_array(close)
+    out = np.full(len(close), np.nan)
+    if len(close) > n:
+        delta = np.diff(close)
+        avg_gain = _wilder(np.clip(delta, 0, None), n)
+        avg_loss = _wilder(np.clip(-delta, 0, None), n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[1:] = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+    return out
+
+
+def bollinger(values, n=20, k=2.0):
+    """Полосы Боллинджера: (средняя, верхняя, нижняя)"""
+    values = as_array(values)
+    middle = sma(values, n)
+    # Дисперсия не зависит от сдвига: центрируем ряд, чтобы E[x^2] - E[x]^2 не терял точность
+    shifted = values - values.mean() if len(values) else values
+    shifted_mean = sma(shifted, n)
+    std = np.sqrt(np.maximum(sma(shifted * shifted, n) - shifted_mean * shifted_mean, 0))
+    return middle, middle + k * std, middle - k * std
+
+
+def vwap(high, low, close, volume):
+    """Средневзвешенная по объёму цена с начала ряда"""
+    typical = (as_array(high) + as_array(low) + as_array(close)) / 3
+    volume = as_array(volume)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.cumsum(typical * volume) / np.cumsum(volume)
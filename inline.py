@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+# Сокращения пресетов периода в инлайн-запросе: "@bot SBER 1y"
+PERIOD_ALIASES = {
+    '1d': '1day', '1д': '1day',
+    '1m': '1month', '1м': '1month',
+    '1y': '1year', '1г': '1year',
+    '5y': '5years', '5л': '5years',
+}
+PERIOD_LABELS = {'1day': 'день', '1month': 'месяц', '1year': 'год', '5years': '5 лет'}
+DEFAULT_PERIOD = '1month'
+
+
+def parse_inline_query(text):
+    """(тикер или название, пресет периода) из текста инлайн-запроса или None"""
+    words = text.split()
+    period = DEFAULT_PERIOD
+    if words and words[-1].lower() in PERIOD_ALIASES:
+        period = PERIOD_ALIASES[words.pop().lower()]
+    if not words:
+        return None
+    return ' '.join(words), period
+
+
+class InlineAnswers:
+    """Ответы на инлайн-запросы: пропуск промежуточных запросов, пока пользователь печатает,
+    и общий для всех пользователей кеш ответов по запросу (тикер, период)"""
+
+    def __init__(self, debounce=0.3, ttl=30, max_entries=1000):
+        self.debounce = debounce
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self._latest = {}  # id пользователя -> id последнего инлайн-запроса
+        self._entries = OrderedDict()  # key -> (expires_at, results)
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            debounce=int(os.getenv('INLINE_DEBOUNCE_MS', 300)) / 1000,
+            ttl=int(os.getenv('INLINE_CACHE_TTL', 30)),
+        )
+
+    async def settled(self, user_id, query_id):
+        """Ждёт паузу в наборе: False, если за это время пользователь прислал более новый запрос"""
+        self._latest[user_id] = query_id
+        await asyncio.sleep(self.debounce)
+        if self._latest.get(user_id) != query_id:
+            self.skipped += 1
+            return False
+        del self._latest[user_id]
+        return True
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def peek(self, key):
+        """Ответит ли get(key) без новой сборки: ответ в кеше или уже собирается. Статистику не меняет"""
+        return key in self._inflight or self._lookup(key) is not None
+
+    def put(self, key, results):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key, build):
+        """Результаты из кеша; при промахе build() вызывается один раз на все одновременные запросы.
+        build() возвращает (results, complete): неполный ответ (график не успел) не кешируется"""
+        results = self._lookup(key)
+        if results is not None:
+            self.hits += 1
+            return results
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(build())
+            self._inflight[key] = task
+
+            def done(t):
+                self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is None and t.result()[1]:
+                    self.put(key, t.result()[0])
+
+            task.add_done_callback(done)
+        # shield: ответ продолжает собираться и попадёт в кеш, даже если этот запрос уже не ждёт
+        return (await asyncio.shield(task))[0]
+
+    def stats(self):
+        total = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'skipped': self.skipped,
+            'hit_ratio': (self.hits + self.coalesced) / total if total else 0.0,
+        }
@@ -1,25 +1,104 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InlineQueryResultCachedPhoto,
+                      InputMediaPhoto, InputTextMessageContent, Message, Update)
+from telegram.ext import (Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes, TypeHandler,
+                          InlineQueryHandler)
+from telegram.error import TelegramError
 # import yfinance as yf
-from moexalgo import Ticker
 from datetime import date, datetime, timedelta
 # import matplotlib.dates as mdates
 from io import BytesIO
-import matplotlib.pyplot as plt
 from dotenv import load_dotenv
 import os
-import locale
-import pandas as pd
-from mplfinance.original_flavor import candlestick_ohlc
-import numpy as np
-
-locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
-
-def clear_cache(context, pattern='chart_'):
-    """Удаляет все ключи, начинающиеся с pattern"""
-    keys = [k for k in context.user_data if k.startswith(pattern)]
-    for k in keys:
-        context.user_data.pop(k, None)
+import re
+import asyncio
+import importlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+from moex_client import MoexClient, MoexTimeoutError
+from candle_cache import CandleCache
+from candle_store import CandleStore
+from image_profile import OutputProfile, FULL_RESOLUTION, THUMBNAIL
+from ru_text import plural_day_ru, type_gap_to_ru
+from render_pool import RenderPool, RenderBusyError, RenderUnavailableError
+from downsample import downsample, LINE_MAX_POINTS, CANDLE_MAX_POINTS
+from chart_cache import ChartCache, chart_ttl
+from securities import SecuritiesIndex
+from session import UserSession, PlotParams, SqlitePersistence
+from update_processor import PerUserUpdateProcessor
+from prefetch import Prefetcher, preset_dates, off_hours_ttl, SEED_INTERVALS
+from compare import parse_tickers, align_returns, MAX_COMPARE_TICKERS
+from alerts import AlertEngine, parse_alert, ABOVE, BELOW
+from streaming import should_stream, stream_candles
+from metrics import Metrics, MetricsServer, RequestProfiler
+from inline import InlineAnswers, parse_inline_query, PERIOD_LABELS
+from rate_limit import UserRateLimiter, PriorityScheduler, RateLimitedError, RENDER, FETCH, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Тяжёлые библиотеки не импортируются при старте: модули бота загружают их при первом обращении,
+# а фоновый прогрев делает это сразу после начала опроса, чтобы первый график не ждал импорта
+BACKGROUND_IMPORTS = ('numpy', 'pandas', 'moexalgo')
+
+# Как часто обновлять справочник бумаг MOEX, сек
+SECURITIES_REFRESH_INTERVAL = 6 * 3600
+
+# Сессии пользователей, неактивных дольше этого времени, удаляются, сек
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_HOURS', 24)) * 3600
+SESSION_EVICT_INTERVAL = 10 * 60
+
+# Размер, формат и сжатие отправляемых фото
+OUTPUT_PROFILE = OutputProfile.from_env()
+
+# Всё, что влияет на картинку помимо данных: входит в ключ общего кеша графиков
+RENDER_SETTINGS = ('15x7', LINE_MAX_POINTS, CANDLE_MAX_POINTS)
+
+# Пользователи Telegram, которым доступны /stats и /profile
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+
+# Telegram ограничивает частоту правок сообщения, сек
+PROGRESS_EDIT_INTERVAL = 1.5
+
+# Как часто проверять уведомления о цене, сек
+ALERTS_INTERVAL = int(os.getenv('ALERTS_INTERVAL', 60))
+
+ALERT_USAGE = (
+    'Уведомления о цене:\n'
+    '/alert SBER > 300 — цена поднимется до 300₽\n'
+    '/alert SBER < 250 — цена опустится до 250₽\n'
+    '/alert SBER 5% — цена изменится на 5% от текущей\n'
+    '/alerts — список уведомлений, /unalert <номер> — удалить'
+)
+
+# Инлайн-ответ должен уложиться в это время, иначе Telegram покажет пользователю пустой список, сек
+INLINE_TIMEOUT = float(os.getenv('INLINE_TIMEOUT', 3))
+# Сколько ждать отрисовки миниатюры, прежде чем ответить только ценой, сек
+INLINE_CHART_WAIT = 1.5
+# Служебный чат (например, закрытый канал), через который миниатюры загружаются в Telegram ради file_id
+INLINE_CACHE_CHAT_ID = int(os.getenv('INLINE_CACHE_CHAT_ID', 0)) or None
+# Так выглядят тикеры MOEX: по остальному тексту инлайн-запроса ищем только в справочнике
+TICKER_RE = re.compile(r'[A-Z0-9_-]+')
+
+# Дорогие кнопки под графиком: из повторных нажатий, ждущих очереди, достаточно выполнить последнее
+COLLAPSIBLE_CALLBACKS = ('set_chart_type:', 'full_size', 'time_gap:')
+
+# Как часто планировщик прогрева проверяет популярные запросы, сек
+PREFETCH_TICK_INTERVAL = 60
+
+COMPANIES = [
+    ['Сбербанк', 'SBER'],
+    ['Газпром', 'GAZP'],
+    ['Новатэк', 'NVTK']
+]
+
+# Интервалы, которые предлагаются для готовых периодов
+PERIOD_TIME_GAPS = {
+    '1day': ['1 min', '10 min', '1 hour'],
+    '1month': ['10 min', '1 hour', '1 day'],
+    '1year': ['1 hour', '1 day', '1 week'],
+    '5years': ['1 day', '1 week', '1 month'],
+}
 
 def times_line_message(start, end, delta):
     if delta >= 1:
@@ -30,163 +109,18 @@ def times_line_message(start, end, delta):
 def get_available_frequencies(n_days: int) -> list[str]:
     if n_days == 0:
         n_days = 1
+    # Длинные внутридневные периоды загружаются частями и сворачиваются (streaming.py),
+    # поэтому месяцы минутных свечей не держат в памяти весь ряд
     frequency_rules = [
-        ("1 min", 1, 3),
-        ("10 min", 1, 30),
-        ("1 hour", 1, 180),
+        ("1 min", 1, 180),
+        ("10 min", 1, 730),
+        ("1 hour", 1, 1460),
         ("1 day", 30, 4000),
         ("1 week", 210, 8400),
         ("1 month", 672, 8400)
     ]
     return [code for code, min_d, max_d in frequency_rules if min_d <= n_days <= max_d]
 
-def plural_day_ru(n):
-    n = abs(n) % 100
-    n1 = n % 10
-
-    if 11 <= n <= 19:
-        return "дней"
-    elif n1 == 1:
-        return "день"
-    elif 2 <= n1 <= 4:
-        return "дня"
-    else:
-        return "дней"
-
-def type_gap_to_ru(s):
-    dict_type_to_rus = {
-        '1min': 'минутный',
-        '10min': '10-минутный',
-        '1h': 'часовой',
-        '1d': 'дневной',
-        '1w': 'недельный',
-        '1m': 'месячный',
-    }
-    return dict_type_to_rus[s]
-
-def format_days_human(n_days):
-    if n_days >= 365 * 2:
-        years = n_days // 365
-        return f"{years} {'года' if 2 <= years <= 4 else 'лет'}"
-    elif n_days >= 60:
-        months = n_days // 30
-        return f"{months} {'месяца' if 2 <= months <= 4 else 'месяцев'}"
-    elif n_days >= 7:
-        weeks = n_days // 7
-        return f"{weeks} {'недели' if 2 <= weeks <= 4 else 'недель'}"
-    elif n_days == 0:
-        return "1 день"
-    else:
-        return f"{n_days} {'день' if n_days == 1 else 'дня' if 2 <= n_days <= 4 else 'дней'}"
-
-def converter_to_heikin_ashi_dataframe(df):
-    open_, high, low, close = df['open'].values, df['high'].values, df['low'].values, df['close'].values
-    n = len(df)
-    ha_open = np.empty(n)
-    ha_close = (open_ + high + low + close) / 4
-
-    ha_open[0] = (open_[0] + close[0]) / 2
-    for i in range(1, n):
-        ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2
-
-    ha_high = np.maximum.reduce([high, ha_open, ha_close])
-    ha_low = np.minimum.reduce([low, ha_open, ha_close])
-
-    ha_df = pd.DataFrame({
-        'begin': df['begin'],
-        'open': ha_open,
-        'high': ha_high,
-        'low': ha_low,
-        'close': ha_close
-    })
-    return ha_df
-
-def paint_plot(df, ticker, start_date, end_date, date_type, date_delta, chart_type='line'):
-    # плавающие гиперпараметры
-    len_x = 15
-    days = plural_day_ru(date_delta)
-    gap_type = type_gap_to_ru(date_type)
-    if date_delta >= 1:
-        part_header_time_gap = f'{start_date.strftime('%d.%m.%y')} - {end_date.strftime('%d.%m.%y')}'
-    else:
-        part_header_time_gap = f'{start_date.strftime('%d.%m.%y')}'
-
-    if date_delta <= 3:
-        x_date_format = '%d.%m %H:%M'
-    elif date_delta <= 90:
-        x_date_format = '%d.%m.%y'
-    else:
-        x_date_format = '%b %Y'
-
-    df['begin'] = pd.to_datetime(df['begin'])
-
-    df['x'] = range(len(df))
-
-    plt.style.use('seaborn-v0_8-darkgrid')
-    plt.rcParams['font.family'] = 'Times New Roman'
-    fig, ax = plt.subplots(figsize=(len_x, 7))
-
-
-    if chart_type == 'line':
-        # плавающие гиперпараметры (line)
-        if len(df) >= 500:
-            linewidth = 1.7
-        elif len(df) >= 1000:
-            linewidth = 1.3
-        elif len(df) >= 2000:
-            linewidth = 1.1
-        elif len(df) >= 4000:
-            linewidth = 0.9
-        else:
-            linewidth = 2
-
-        # x = list(range(len(df)))
-        x = df['x'].values
-        y = df['open'].values
-
-        # Основной график
-        ax.plot(x, y,
-                linewidth=linewidth,
-                color="#3d69b7",
-                label='Цена открытия')
-        ax.legend(fontsize=12)
-
-    elif chart_type == 'candles':
-        quotes = df[['x', 'open', 'high', 'low', 'close']].astype(float).values
-        candlestick_ohlc(ax, quotes, width=0.6,
-                        colorup='green', colordown='red', alpha=0.8)
-    
-    elif chart_type == 'heiken-ashi':
-        ha_df = converter_to_heikin_ashi_dataframe(df)
-        ha_df['x'] = range(len(ha_df))
-        quotes = ha_df[['x', 'open', 'high', 'low', 'close']].astype(float).values
-        candlestick_ohlc(ax, quotes, width=0.6,
-                         colorup='green', colordown='red', alpha=0.8)
-
-
-    ax.set_title(f'{ticker} | {part_header_time_gap} | {format_days_human(date_delta)} ({len(df)} точек) | Последняя цена: {df.iloc[-1]["close"]:.1f}₽',
-                fontsize=20, pad=20, fontweight='bold')
-    ax.set_xlabel('Дата', fontsize=16)
-    ax.set_ylabel('Цена (₽)', fontsize=16)
-
-    # Отображаем подписи дат на оси X с шагом
-    step_x = max(len(df) // 10, 1)
-    xticks = df['x'][::step_x]
-    xticklabels = df['begin'].dt.strftime(x_date_format)[::step_x]
-
-    ax.grid(True, alpha=0.4)
-    ax.set_xticks(xticks)
-    ax.set_xticklabels(xticklabels, rotation=45)
-    plt.tight_layout()
-
-    buf = BytesIO()
-    plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
-
-
-    return buf
-
 def get_chart_type_keyboard(current_type):
     types = {
         'line': '📈 Линия',
@@ -201,21 +135,60 @@ def get_chart_type_keyboard(current_type):
             )
             for t, label in types.items()
         ],
-        [InlineKeyboardButton(f"{'✅ ' if 'heiken-ashi' == current_type else ''}🌀 Хейкен-Аши", callback_data='set_chart_type:heiken-ashi')]
+        [InlineKeyboardButton(f"{'✅ ' if 'heiken-ashi' == current_type else ''}🌀 Хейкен-Аши", callback_data='set_chart_type:heiken-ashi')],
+        [InlineKeyboardButton('🖼 В полном размере', callback_data='full_size')]
         # [InlineKeyboardButton('✅ 🌀 Хейкен-Аши' if current_type=='heiken_ashi' else '🌀 Хейкен-Аши', callback_data='set_chart_type:heiken-ashi')]
         # [InlineKeyboardButton("🔙 Назад", callback_data='go_back')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
 
+def instrumented(handler):
+    """Замер длительности обработчика; после /profile — отчёт профилировщика администратору"""
+    @wraps(handler)
+    async def wrapper(update, context):
+        with context.bot_data['profiler'].profile(update.effective_user.id) as profile, \
+                context.bot_data['metrics'].stage(handler.__name__):
+            await handler(update, context)
+        if 'report' in profile:
+            await update.effective_message.reply_document(
+                document=BytesIO(profile['report'].encode()),
+                filename=f'profile_{handler.__name__}.txt'
+            )
+    return wrapper
+
+
+def securities_keyboard(securities):
+    keyboard = [
+        [InlineKeyboardButton(f'{security.name} ({security.ticker})', callback_data=f'ticker_{security.ticker}')]
+        for security in securities
+    ]
+    keyboard.append([InlineKeyboardButton('🔙 Назад', callback_data='go_back')])
+    return InlineKeyboardMarkup(keyboard)
+
+async def ticker_exists(context, ticker):
+    """Проверка тикера: справочник акций и индексов, а если в нём нет (валюта, фьючерсы, справочник ещё не загружен) —
+    запрос к бирже. MoexTimeoutError пробрасывается: по таймауту нельзя сказать, что тикера нет"""
+    if ticker in context.bot_data['securities']:
+        return True
+    try:
+        await context.bot_data['moex'].ticker(ticker)
+    except MoexTimeoutError:
+        raise
+    except Exception:
+        return False
+    return True
+
 
 # Функция для обработки кнопки "Назад"
 async def handle_back(update, context):
     query = update.callback_query
     await query.answer()
 
-    stack = context.user_data.get('history_steps', [])
+    stack = context.user_data.history_steps
 
+    # После перезапуска или вытеснения сессии истории может не быть
+    previous_step = 'start'
     if stack:
         stack.pop()
         previous_step = stack[-1] if stack else 'start'
@@ -227,7 +200,8 @@ async def handle_back(update, context):
 async def start(update, context):
     keyboard_menu = [
         [InlineKeyboardButton('📝 Ввести тикер вручную', callback_data='manual_ticker_input')],
-        [InlineKeyboardButton('🏦 Выбрать из списка', callback_data='company_list')]
+        [InlineKeyboardButton('🏦 Выбрать из списка', callback_data='company_list')],
+        [InlineKeyboardButton('⚖️ Сравнить несколько тикеров', callback_data='compare_input')]
     ]
 
     if hasattr(update, 'message') and update.message:
@@ -240,22 +214,53 @@ async def start(update, context):
         await query.edit_message_text("📊 Выберите способ:",
                                  reply_markup=InlineKeyboardMarkup(keyboard_menu)
                                  )
-    stack = context.user_data.setdefault('history_steps', [])
-    if not stack or stack[-1] != 'start':
-        stack.append('start')
+    context.user_data.push_step('start')
     
 async def handle_text(update, context):
-    input_query = context.user_data.get('awaiting_input_type')
+    input_query = context.user_data.awaiting_input_type
 
     if input_query == 'ticker':
         ticker = update.message.text.strip().upper()
         try:
-            Ticker(ticker)
-            context.user_data['ticker'] = ticker
-            context.user_data.pop("awaiting_input_type", None)
-            await period_menu(update, context)
-        except Exception as e:
-            await update.message.reply_text(f'❌ Ошибка: {str(e)}.\nПроверьте тикер и попробуйте ещё раз')
+            exists = await ticker_exists(context, ticker)
+        except MoexTimeoutError as e:
+            await update.message.reply_text(f'⚠️ {e}. Попробуйте ещё раз чуть позже.')
+            return
+        if not exists:
+            suggestions = context.bot_data['securities'].search(ticker)
+            await update.message.reply_text(
+                f'❌ Тикер {ticker} не найден.\nПроверьте тикер и попробуйте ещё раз'
+                + ('\n\nВозможно, вы имели в виду:' if suggestions else ''),
+                reply_markup=securities_keyboard(suggestions)
+            )
+            return
+        context.user_data.ticker = ticker
+        context.user_data.tickers = []
+        context.user_data.awaiting_input_type = None
+        await period_menu(update, context)
+
+    elif input_query == 'compare':
+        tickers = parse_tickers(update.message.text)
+        if not 2 <= len(tickers) <= MAX_COMPARE_TICKERS:
+            await update.message.reply_text(f'❌ Укажите от 2 до {MAX_COMPARE_TICKERS} тикеров через запятую, например: SBER, GAZP, NVTK')
+            return
+        # Тикеры не из справочника проверяются параллельно запросами к бирже
+        checks = await asyncio.gather(*(ticker_exists(context, ticker) for ticker in tickers), return_exceptions=True)
+        unknown = [ticker for ticker, check in zip(tickers, checks) if check is not True]
+        if unknown:
+            await update.message.reply_text(f'❌ Не найдены тикеры: {", ".join(unknown)}.\nПроверьте их и попробуйте ещё раз')
+            return
+        context.user_data.ticker = tickers[0]
+        context.user_data.tickers = tickers
+        context.user_data.awaiting_input_type = None
+        await period_menu(update, context)
+
+    elif input_query == 'company_search':
+        found = context.bot_data['securities'].search(update.message.text)
+        await update.message.reply_text(
+            '🔍 Выберите компанию:' if found else '🤷 Ничего не найдено. Попробуйте другое название',
+            reply_markup=securities_keyboard(found)
+        )
     
     elif input_query == 'date_range':
         text = update.message.text.strip()
@@ -271,8 +276,9 @@ async def handle_text(update, context):
                 await update.message.reply_text("❌ Начальная дата позже конечной.")
                 return
             
-            context.user_data["start_end_dates"] = (start_date, end_date)
-            context.user_data.pop("awaiting_input_type", None)
+            context.user_data.start_date, context.user_data.end_date = start_date, end_date
+            context.user_data.period = ''
+            context.user_data.awaiting_input_type = None
 
             await time_gap_menu(update, context, get_available_frequencies((end_date - start_date).days))
 
@@ -290,38 +296,56 @@ async def manual_ticker_input(update, context):
                                       [[InlineKeyboardButton('🔙 Назад', callback_data='go_back')]]
                                   ))
     
-    context.user_data["awaiting_input_type"] = "ticker"
+    context.user_data.awaiting_input_type = "ticker"
+
+    context.user_data.push_step('manual_ticker_input')
 
-    stack = context.user_data.setdefault('history_steps', [])
-    if not stack or stack[-1] != 'manual_ticker_input':
-        stack.append('manual_ticker_input')
+async def compare_input(update, context):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(f'✏️ Введите от 2 до {MAX_COMPARE_TICKERS} тикеров через запятую (например: SBER, GAZP, NVTK):',
+                                  reply_markup=InlineKeyboardMarkup(
+                                      [[InlineKeyboardButton('🔙 Назад', callback_data='go_back')]]
+                                  ))
+
+    context.user_data.awaiting_input_type = "compare"
+
+    context.user_data.push_step('compare_input')
 
 # Меню компаний (3 кнопки)
 async def company_list(update, context):
     query = update.callback_query
     await query.answer()
 
-    companies = [
-        ['Сбербанк', 'SBER'],
-        ['Газпром', 'GAZP'],
-        ['Новатэк', 'NVTK']
-    ]
-
-    keyboard_select_companies = [[InlineKeyboardButton(name, callback_data=f'ticker_{ticker}')] for name, ticker in companies]
+    keyboard_select_companies = [[InlineKeyboardButton(name, callback_data=f'ticker_{ticker}')] for name, ticker in COMPANIES]
+    if context.bot_data['securities'].loaded:
+        keyboard_select_companies.append([InlineKeyboardButton('🔎 Найти по названию', callback_data='company_search')])
     keyboard_select_companies.append([InlineKeyboardButton('🔙 Назад', callback_data='go_back')])  # Добавляем кнопку "Назад"
     await query.edit_message_text(
         '🔍 Выберите компанию:',
         reply_markup=InlineKeyboardMarkup(keyboard_select_companies)
     )
-    stack = context.user_data.setdefault('history_steps', [])
-    if not stack or stack[-1] != 'company_list':
-        stack.append('company_list')
+    context.user_data.push_step('company_list')
+
+async def company_search(update, context):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text('✏️ Введите название компании или начало тикера (например: Газпром, ЛУКОЙЛ, YDE):',
+                                  reply_markup=InlineKeyboardMarkup(
+                                      [[InlineKeyboardButton('🔙 Назад', callback_data='go_back')]]
+                                  ))
+
+    context.user_data.awaiting_input_type = "company_search"
+
+    context.user_data.push_step('company_search')
 
 async def handle_ticker(update, context):
     query = update.callback_query
     await query.answer()
     ticker = query.data.replace('ticker_', '')
-    context.user_data['ticker'] = ticker
+    context.user_data.ticker = ticker
+    context.user_data.tickers = []
+    context.user_data.awaiting_input_type = None
     await period_menu(update, context)
 
 async def period_menu(update, context):
@@ -342,12 +366,10 @@ async def period_menu(update, context):
 
     keyboard_period.append([InlineKeyboardButton('🔙 Назад', callback_data='go_back')])
     await edit_message(
-        f"⏳ Выберите период для {context.user_data.get('ticker', '')}:",
+        f"⏳ Выберите период для {', '.join(context.user_data.tickers) or context.user_data.ticker}:",
         reply_markup=InlineKeyboardMarkup(keyboard_period)
     )
-    stack = context.user_data.setdefault('history_steps', [])
-    if not stack or stack[-1] != 'period_menu':
-        stack.append('period_menu')
+    context.user_data.push_step('period_menu')
 
 async def manual_dates_input(update, context):
     query = update.callback_query
@@ -356,34 +378,20 @@ async def manual_dates_input(update, context):
                                 reply_markup=InlineKeyboardMarkup(
                                     [[InlineKeyboardButton('🔙 Назад', callback_data='go_back')]]
                                 ))
-    context.user_data["awaiting_input_type"] = "date_range"
+    context.user_data.awaiting_input_type = "date_range"
 
-    stack = context.user_data.setdefault('history_steps', [])
-    if not stack or stack[-1] != 'manual_dates_input':
-        stack.append('manual_dates_input')
+    context.user_data.push_step('manual_dates_input')
 
 async def handle_period(update, context):
     query = update.callback_query
     await query.answer()
     period = query.data.replace('period_', '')
 
-    end_date = date.today()
-    if period == '1day':
-        start_date = end_date - timedelta(days=1)
-        time_gap_correct_buttons = ['1 min', '10 min', '1 hour']
-    elif period == '1month':
-        start_date = end_date - timedelta(days=30)
-        time_gap_correct_buttons = ['10 min', '1 hour', '1 day']
-    elif period == '1year':
-        start_date = end_date - timedelta(days=365)
-        time_gap_correct_buttons = ['1 hour', '1 day', '1 week']
-    elif period == '5years':
-        start_date = end_date - timedelta(days=5*365)
-        time_gap_correct_buttons = ['1 day', '1 week', '1 month']
+    start_date, end_date = preset_dates(period)
+    time_gap_correct_buttons = PERIOD_TIME_GAPS[period]
 
-    
-    context.user_data['start_end_dates'] = (start_date, end_date)
-    context.user_data['period'] = period
+    context.user_data.start_date, context.user_data.end_date = start_date, end_date
+    context.user_data.period = period
     
     await time_gap_menu(update, context, time_gap_correct_buttons)
 
@@ -410,71 +418,302 @@ async def time_gap_menu(update, context, list_of_buttons=None):
         '⏳ Выберите временной интервал:',
         reply_markup=InlineKeyboardMarkup(keyboard_time_gap)
     )
-    stack = context.user_data.setdefault('history_steps', [])
-    if not stack or stack[-1] != 'time_gap_menu':
-        stack.append('time_gap_menu')
+    context.user_data.push_step('time_gap_menu')
 
 async def handle_time_gap(update, context):
     query = update.callback_query
     await query.answer()
 
     time_gap = query.data.replace('time_gap:', '')
-    context.user_data['time_gap'] = time_gap
+    context.user_data.time_gap = time_gap
+
+    if context.user_data.tickers:
+        await compare_plot(update, context)
+    else:
+        await ticker_plot(update, context)
+
+async def load_candles(context, ticker, time_gap, start_date, end_date, refresh=False, progress=None, priority=FETCH,
+                       ttl=None):
+    """Свечи из общего кеша; при промахе — из локального хранилища с догрузкой недостающего с MOEX.
+    Длинные внутридневные периоды загружаются частями и в кеш попадают уже свёрнутыми"""
+    moex = context.bot_data['moex']
+    store = context.bot_data['store']
+
+    def fetch_range(start, end, lock_key=None):
+        return store.get(ticker, time_gap, start, end,
+                         lambda gap_start, gap_end: moex.candles(ticker, gap_start, gap_end, time_gap),
+                         lock_key=lock_key)
+
+    if should_stream(time_gap, start_date, end_date):
+        load = lambda: stream_candles(lambda start, end: fetch_range(start, end, (ticker, time_gap, start)),
+                                      time_gap, start_date, end_date, progress=progress)
+    else:
+        load = lambda: fetch_range(start_date, end_date)
+
+    async def fetch():
+        async with scheduled(context, priority):
+            return await load()
+
+    return await context.bot_data['candles'].get(ticker, time_gap, start_date, end_date, fetch, refresh=refresh,
+                                                 priority=priority, ttl=ttl)
+
+class LoadingProgress:
+    """Сообщение "Загрузка N%", которое редактируется не чаще раза в PROGRESS_EDIT_INTERVAL секунд"""
+
+    def __init__(self, message, ticker):
+        self.message = message
+        self.ticker = ticker
+        self.status = None
+        self._edited_at = 0.0
+
+    async def __call__(self, done, total):
+        percent = done * 100 // total
+        if done < total and time.monotonic() - self._edited_at < PROGRESS_EDIT_INTERVAL:
+            return
+        self._edited_at = time.monotonic()
+        text = f'⏳ Загрузка {self.ticker}: {percent}%'
+        try:
+            if self.status is None:
+                self.status = await self.message.reply_text(text)
+            else:
+                await self.status.edit_text(text)
+        except Exception:
+            pass  # прогресс не должен мешать построению графика
+
+    async def finish(self):
+        if self.status is not None:
+            try:
+                await self.status.delete()
+            except Exception:
+                pass
+
+def chart_key(params, chart_type, profile=OUTPUT_PROFILE):
+    return ChartCache.key(params.ticker, params.date_type, params.start_date, params.end_date,
+                          chart_type, (*RENDER_SETTINGS, *profile))
+
+async def render_chart(context, params, chart_type, data=None, profile=OUTPUT_PROFILE, series=(), priority=RENDER):
+    """Ключ кеша и график: file_id уже загруженного в Telegram изображения, PNG из кеша или новая отрисовка.
+    Одинаковые графики, запрошенные одновременно, рисуются один раз"""
+    charts = context.bot_data['charts']
+    key = chart_key(params, chart_type, profile)
+    cached = charts.get(key)
+    if cached is not None:
+        file_id, png = cached
+        return key, file_id or BytesIO(png)
+
+    async def draw():
+        metrics = context.bot_data['metrics']
+        candles = data
+        if candles is None:
+            with metrics.stage('fetch'):
+                candles = await load_candles(context, params.ticker, params.date_type, params.request_start, params.request_end,
+                                             priority=max(priority, FETCH))
+        with metrics.stage('prepare'):
+            prepared = downsample(candles, chart_type)
+        async with scheduled(context, priority):
+            return await context.bot_data['render'].render(
+                prepared,
+                ticker=params.ticker,
+                start_date=params.start_date,
+                end_date=params.end_date,
+                date_type=params.date_type,
+                date_delta=params.date_delta,
+                chart_type=chart_type,
+                # У свёрнутых при потоковой загрузке свечей — число исходных свечей, а не точек свёртки
+                n_points=candles.attrs.get('rows', len(candles)),
+                profile=profile,
+                series=series
+            )
+
+    png = await charts.render(key, draw, chart_ttl(params.date_type, params.end_date), priority=priority)
+    return key, BytesIO(png)
+
+@asynccontextmanager
+async def scheduled(context, priority):
+    """Слот общей очереди дорогой работы (загрузка с MOEX, отрисовка); ожидание слота попадает в метрики"""
+    queued = time.perf_counter()
+    async with context.bot_data['scheduler'].slot(priority):
+        context.bot_data['metrics'].observe('expensive_queue', time.perf_counter() - queued)
+        yield
+
+def admit(context, user_id, cached):
+    """Лимит дорогих запросов пользователя: ответы из кешей его не расходуют. Бросает RateLimitedError"""
+    if not cached:
+        context.bot_data['limits'].check(user_id)
+
+def plot_cached(context, ticker, time_gap, start_date, end_date):
+    """Построится ли линейный график только из кешей, без загрузки и отрисовки"""
+    data = context.bot_data['candles'].peek(ticker, time_gap, start_date, end_date)
+    if data is None:
+        return False
+    if data.empty:
+        return True
+    params = build_plot_params(ticker, time_gap, start_date, end_date, data)
+    return context.bot_data['charts'].peek(chart_key(params, 'line'))
 
-    await ticker_plot(update, context)
+def remember_file_id(context, key, message):
+    """Запоминает file_id загруженного графика, чтобы повторно отправлять его без отрисовки и загрузки"""
+    if not isinstance(message, Message):
+        return
+    file = message.photo[-1] if message.photo else message.document
+    if file is not None:
+        context.bot_data['charts'].set_file_id(key, file.file_id)
 
+@instrumented
 async def handler_chart_type_change(update, context):
     query = update.callback_query
     await query.answer()
 
     chart_type = query.data.replace("set_chart_type:", "")
-    context.user_data["chart_type"] = chart_type
+    params = context.user_data.plot
+    if params is None:
+        await query.message.reply_text('⚠️ График устарел. Постройте его заново.')
+        return
+    metrics = context.bot_data['metrics']
+    try:
+        admit(context, update.effective_user.id, context.bot_data['charts'].peek(chart_key(params, chart_type)))
+    except RateLimitedError as e:
+        await query.message.reply_text(f'⏳ {e}.')
+        return
+    context.user_data.chart_type = chart_type
+
+    try:
+        key, media = await render_chart(context, params, chart_type)
+    except RenderBusyError:
+        metrics.inc('render_busy')
+        await query.message.reply_text('⏳ Сервер перегружен, попробуйте через минуту.')
+        return
+    except RenderUnavailableError as e:
+        await query.message.reply_text(f'⚠️ {e}.')
+        return
+    except MoexTimeoutError as e:
+        metrics.inc('moex_timeouts')
+        await query.message.reply_text(f'⚠️ {e}. Попробуйте ещё раз чуть позже.')
+        return
 
-    params = context.user_data.get('plot_params')
-    # Проверяем кеш
-    cache_key = f'chart_{chart_type}'
-    if cache_key in context.user_data:
-        buf = BytesIO(context.user_data[cache_key])
+    with metrics.stage('upload'):
+        message = await query.message.edit_media(
+            media=InputMediaPhoto(
+                media=media,
+                caption=params.caption
+            ),
+            reply_markup=get_chart_type_keyboard(chart_type)
+        )
+    remember_file_id(context, key, message)
 
-    else:
-        data = context.user_data.get('data')
-        buf = paint_plot(
-            data,
-            ticker=params['ticker'],
-            start_date=params['start_date'],
-            end_date=params['end_date'],
-            date_type=params['date_type'],
-            date_delta=params['date_delta'],
-            chart_type=chart_type
+def build_plot_params(ticker, time_gap, start_date, end_date, data):
+    """Параметры графика по загруженным свечам; период сужается до фактических данных, если их заметно меньше"""
+    request_start, request_end = start_date, end_date
+    date_delta = (end_date - start_date).days
+    message_line = times_line_message(start_date, end_date, date_delta)
+
+    # Фактические доступные даты
+    actual_start = data['begin'].min().date()
+    actual_end = data['begin'].max().date()
+
+    # Уведомление, если вводимый период ≠ фактический
+    warning = ""
+    if start_date < actual_start - timedelta(30) or actual_end + timedelta(30) < end_date:
+        warning = (
+            f"⚠️ Данные доступны только за период: {actual_start.strftime('%d.%m.%y')} - {actual_end.strftime('%d.%m.%y')}.\n"
+            f"(Вы указали: {message_line})\n\n"
         )
-        context.user_data[cache_key] = buf.getvalue()  # Сохраняем в кеш
-
-    await query.message.edit_media(
-        media=InputMediaPhoto(
-            media=buf,
-            caption=params['caption']
-        ),
-        reply_markup=get_chart_type_keyboard(chart_type)
+        start_date, end_date = actual_start, actual_end
+        date_delta = (actual_end - actual_start).days
+        message_line = times_line_message(start_date, end_date, date_delta)
+
+    days_count = date_delta or 1
+
+    caption = warning + (
+                f"📊 График {ticker} за {message_line} ({days_count} {plural_day_ru(days_count)})\n"
+                f"📏 Частота данных: {type_gap_to_ru(time_gap)} формат\n"
+                f"🔄 Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+    )
+
+    return PlotParams(
+        ticker=ticker,
+        start_date=start_date,
+        end_date=end_date,
+        date_type=time_gap,
+        date_delta=date_delta,
+        caption=caption,
+        request_start=request_start,
+        request_end=request_end
     )
-    buf.close()
 
+@instrumented
+async def send_full_size(update, context):
+    query = update.callback_query
+    await query.answer()
+
+    session = context.user_data
+    params = session.plot
+    if params is None:
+        await query.message.reply_text('⚠️ График устарел. Постройте его заново.')
+        return
+    metrics = context.bot_data['metrics']
+    try:
+        admit(context, update.effective_user.id,
+              context.bot_data['charts'].peek(chart_key(params, session.chart_type, FULL_RESOLUTION)))
+        key, document = await render_chart(context, params, session.chart_type, profile=FULL_RESOLUTION)
+    except RateLimitedError as e:
+        await query.message.reply_text(f'⏳ {e}.')
+        return
+    except RenderBusyError:
+        metrics.inc('render_busy')
+        await query.message.reply_text('⏳ Сервер перегружен, попробуйте через минуту.')
+        return
+    except RenderUnavailableError as e:
+        await query.message.reply_text(f'⚠️ {e}.')
+        return
+    except MoexTimeoutError as e:
+        metrics.inc('moex_timeouts')
+        await query.message.reply_text(f'⚠️ {e}. Попробуйте ещё раз чуть позже.')
+        return
+
+    # Документом: Telegram не пережимает файл, как фото
+    with metrics.stage('upload'):
+        message = await query.message.reply_document(
+            document=document,
+            filename=f'{params.ticker}_{session.chart_type}_{params.start_date:%Y%m%d}-{params.end_date:%Y%m%d}.png'
+        )
+    remember_file_id(context, key, message)
+
+@instrumented
 async def ticker_plot(update, context):
     query = update.callback_query
     await query.answer()
 
-    ticker = context.user_data.get('ticker', '')
-    start_date, end_date = context.user_data.get('start_end_dates', (date.today() - timedelta(days=30), date.today()))
-    time_gap = context.user_data.get('time_gap', '1d')
+    session = context.user_data
+    ticker = session.ticker
+    start_date = session.start_date or date.today() - timedelta(days=30)
+    end_date = session.end_date or date.today()
+    time_gap = session.time_gap
 
     # data = Ticker(ticker).candles(start = '2025-06-01', end = date.today())
     # price = data.iloc[-1, 0]
     # await message.reply_text(f"Цена открытия {ticker} ({data.iloc[-1, 7].strftime('%Y-%m-%d')}): {price:.2f} RUB")
 
-    data = Ticker(ticker).candles(start = start_date, end = end_date, period=time_gap)
-    
     date_delta = (end_date - start_date).days
     
     message_line = times_line_message(start_date, end_date, date_delta)
+
+    metrics = context.bot_data['metrics']
+    try:
+        admit(context, update.effective_user.id, plot_cached(context, ticker, time_gap, start_date, end_date))
+    except RateLimitedError as e:
+        await query.message.reply_text(f'⏳ {e}.')
+        return
+    progress = LoadingProgress(query.message, ticker)
+    try:
+        with metrics.stage('fetch'):
+            data = await load_candles(context, ticker, time_gap, start_date, end_date, progress=progress)
+    except MoexTimeoutError as e:
+        metrics.inc('moex_timeouts')
+        await query.message.reply_text(f'⚠️ {e}. Попробуйте ещё раз чуть позже.')
+        return
+    finally:
+        await progress.finish()
         
     if data.empty:
         await query.message.reply_text(
@@ -487,77 +726,462 @@ async def ticker_plot(update, context):
         await handle_back(update, context)
         return
     
-    # Фактические доступные даты
-    actual_start = data['begin'].min().date()
-    actual_end = data['begin'].max().date()
+    # В сессии только параметры: свечи и картинки берутся из общих кешей по ключу
+    with metrics.stage('prepare'):
+        session.plot = build_plot_params(ticker, time_gap, start_date, end_date, data)
+    session.chart_type = 'line'
+    if session.period:
+        context.bot_data['prefetch'].record(ticker, session.period, time_gap)
+
+    try:
+        key, photo = await render_chart(context, session.plot, 'line', data)
+    except RenderBusyError:
+        metrics.inc('render_busy')
+        await query.message.reply_text('⏳ Сервер перегружен, попробуйте через минуту.')
+        return
+    except RenderUnavailableError as e:
+        await query.message.reply_text(f'⚠️ {e}.')
+        return
 
-    # Уведомление, если вводимый период ≠ фактический
-    warning = ""
-    if start_date < actual_start - timedelta(30) or actual_end + timedelta(30) < end_date:
-        warning = (
-            f"⚠️ Данные доступны только за период: {actual_start.strftime('%d.%m.%y')} - {actual_end.strftime('%d.%m.%y')}.\n"
-            f"(Вы указали: {message_line})\n\n"
+    # Свечи прореживаются до читаемого количества, поэтому выбор типа графика доступен для любого периода
+    with metrics.stage('upload'):
+        message = await query.message.reply_photo(
+            photo=photo,
+            caption=session.plot.caption,
+            reply_markup=get_chart_type_keyboard(session.chart_type)
         )
-        start_date, end_date = actual_start, actual_end
-        date_delta = (actual_end - actual_start).days
-        message_line = times_line_message(start_date, end_date, date_delta)
+    remember_file_id(context, key, message)
+
+async def warm_chart(context, ticker, period, time_gap, prerender):
+    """Прогрев кешей для пресета периода: свежие свечи и, по желанию, готовый линейный график"""
+    start_date, end_date = preset_dates(period)
+    data = await load_candles(context, ticker, time_gap, start_date, end_date, refresh=True, priority=BACKGROUND,
+                              ttl=off_hours_ttl(time_gap))
+    if prerender and not data.empty:
+        await render_chart(context, build_plot_params(ticker, time_gap, start_date, end_date, data), 'line', data,
+                           priority=BACKGROUND)
+
+@instrumented
+async def compare_plot(update, context):
+    query = update.callback_query
+    await query.answer()
 
-    # Чистим кеш
-    clear_cache(context)
+    session = context.user_data
+    tickers = session.tickers
+    start_date = session.start_date or date.today() - timedelta(days=30)
+    end_date = session.end_date or date.today()
+    time_gap = session.time_gap
+    date_delta = (end_date - start_date).days
+    message_line = times_line_message(start_date, end_date, date_delta)
 
-    buf = paint_plot(data, ticker, start_date, end_date, time_gap, date_delta)
+    candles = context.bot_data['candles']
+    try:
+        admit(context, update.effective_user.id,
+              all(candles.peek(ticker, time_gap, start_date, end_date) is not None for ticker in tickers))
+    except RateLimitedError as e:
+        await query.message.reply_text(f'⏳ {e}.')
+        return
 
-    date_delta = date_delta or 1
+    # Все тикеры загружаются одновременно: ожидание — как у самой медленной загрузки, а не сумма
+    metrics = context.bot_data['metrics']
+    with metrics.stage('fetch'):
+        results = await asyncio.gather(
+            *(load_candles(context, ticker, time_gap, start_date, end_date) for ticker in tickers),
+            return_exceptions=True
+        )
+    for result in results:
+        if isinstance(result, MoexTimeoutError):
+            metrics.inc('moex_timeouts')
+            await query.message.reply_text(f'⚠️ {result}. Попробуйте ещё раз чуть позже.')
+            return
+        if isinstance(result, Exception):
+            raise result
+
+    frames = {ticker: data for ticker, data in zip(tickers, results) if not data.empty}
+    missing = [ticker for ticker in tickers if ticker not in frames]
+    with metrics.stage('prepare'):
+        returns = align_returns(frames) if len(frames) >= 2 else None
+    if returns is None or returns.empty:
+        await query.message.reply_text(
+            f"⚠️ Недостаточно данных для сравнения {', '.join(tickers)} в период {message_line}.\n"
+            f"Попробуйте изменить период или интервал."
+        )
+        await handle_back(update, context)
+        return
 
-    caption = warning + (
-                f"📊 График {ticker} за {message_line} ({date_delta} {plural_day_ru(date_delta)})\n"
-                f"📏 Частота данных: {type_gap_to_ru(time_gap)} формат\n"
-                f"🔄 Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+    series = list(frames)
+    days_count = date_delta or 1
+    last = returns.iloc[-1]
+    caption = (
+        f"📊 Сравнение {', '.join(series)} за {message_line} ({days_count} {plural_day_ru(days_count)})\n"
+        f"📏 Частота данных: {type_gap_to_ru(time_gap)} формат\n"
+        f"📈 Доходность за период: {', '.join(f'{ticker} {last[ticker]:+.1f}%' for ticker in series)}\n"
+        + (f"⚠️ Нет данных: {', '.join(missing)}\n" if missing else '')
+        + f"🔄 Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
     )
+    params = PlotParams(
+        ticker=','.join(series),
+        start_date=start_date,
+        end_date=end_date,
+        date_type=time_gap,
+        date_delta=date_delta,
+        caption=caption,
+        request_start=start_date,
+        request_end=end_date
+    )
+    # Кнопки типа графика и полного размера относятся к графику одного тикера
+    session.plot = None
+
+    try:
+        key, photo = await render_chart(context, params, 'compare', returns, series=series)
+    except RenderBusyError:
+        metrics.inc('render_busy')
+        await query.message.reply_text('⏳ Сервер перегружен, попробуйте через минуту.')
+        return
+    except RenderUnavailableError as e:
+        await query.message.reply_text(f'⚠️ {e}.')
+        return
 
-    context.user_data['data'] = data
-    context.user_data['plot_params'] = {
-    'ticker': ticker,
-    'start_date': start_date,
-    'end_date': end_date,
-    'date_type': time_gap,
-    'date_delta': date_delta,
-    'caption': caption
-    }
-    context.user_data['chart_type'] = 'line'
+    with metrics.stage('upload'):
+        message = await query.message.reply_photo(photo=photo, caption=caption)
+    remember_file_id(context, key, message)
 
+async def latest_candles(context, ticker):
+    """Сегодняшние минутные свечи: один запрос на тикер через общий кеш, сколько бы уведомлений ни ждало"""
+    today = date.today()
+    return await load_candles(context, ticker, '1min', today, today)
 
-    if len(data) <= 220:
-        await query.message.reply_photo(
-            photo=buf,
-            caption=caption,
-            reply_markup=get_chart_type_keyboard(context.user_data['chart_type'])
+async def last_price(context, ticker):
+    data = await latest_candles(context, ticker)
+    if data.empty:
+        # Выходной или торги ещё не начались — берём последнее дневное закрытие
+        today = date.today()
+        data = await load_candles(context, ticker, '1d', today - timedelta(days=14), today)
+    return None if data.empty else float(data['close'].iloc[-1])
+
+def price_cached(context, ticker):
+    """Найдётся ли последняя цена для last_price в кеше свечей, без запросов к MOEX"""
+    candles = context.bot_data['candles']
+    today = date.today()
+    data = candles.peek(ticker, '1min', today, today)
+    if data is None:
+        return False
+    return not data.empty or candles.peek(ticker, '1d', today - timedelta(days=14), today) is not None
+
+def resolve_ticker(context, name):
+    """Тикер по тому, что пользователь набрал в инлайн-запросе: сам тикер или начало названия"""
+    securities = context.bot_data['securities']
+    ticker = name.upper()
+    if ticker in securities:
+        return ticker
+    if not securities.loaded:
+        # Пока справочника нет, поиск по названию невозможен: "сбер" не превращаем в тикер "СБЕР"
+        return ticker if TICKER_RE.fullmatch(ticker) else None
+    found = securities.search(name, limit=1)
+    if found:
+        return found[0].ticker
+    # Валюта и фьючерсы (CNYRUB_TOM, USD000UTSTOM) в справочник не входят: такой тикер проверит сам запрос свечей
+    return ticker if TICKER_RE.fullmatch(ticker) else None
+
+async def inline_chart(context, params, data):
+    """file_id линейного графика для инлайн-ответа: уже отправленный кому-то график или новая миниатюра"""
+    cached = context.bot_data['charts'].get(chart_key(params, 'line'))
+    if cached is not None and cached[0]:
+        return cached[0]
+    if INLINE_CACHE_CHAT_ID is None:
+        return None
+    key, media = await render_chart(context, params, 'line', data, profile=THUMBNAIL)
+    if isinstance(media, str):
+        return media
+    # В инлайн-ответе можно показать только файл, уже загруженный в Telegram
+    message = await context.bot.send_photo(INLINE_CACHE_CHAT_ID, media, disable_notification=True)
+    remember_file_id(context, key, message)
+    return message.photo[-1].file_id
+
+async def inline_answer(context, ticker, period):
+    """Результаты инлайн-запроса и признак полноты: цена сразу, график — если успел за INLINE_CHART_WAIT"""
+    time_gap = SEED_INTERVALS[period]
+    start_date, end_date = preset_dates(period)
+    try:
+        price, data = await asyncio.gather(
+            last_price(context, ticker),
+            load_candles(context, ticker, time_gap, start_date, end_date)
         )
-    else:
-        await query.message.reply_photo(
-            photo=buf,
-            caption=caption
+    except MoexTimeoutError:
+        raise
+    except Exception as e:
+        # Набранный текст не оказался тикером (справочник ещё не загружен, опечатка): ответ — пустой список
+        logger.info('Нет свечей для инлайн-запроса %s: %s', ticker, e)
+        return [], True
+    if price is None or data.empty:
+        return [], True
+
+    change = (price / float(data['open'].iloc[0]) - 1) * 100
+    summary = f'{ticker}: {price:g}₽, {change:+.2f}% за {PERIOD_LABELS[period]}'
+    results = [InlineQueryResultArticle(
+        id=f'price:{ticker}:{period}',
+        title=f'{ticker}: {price:g}₽',
+        description=f'{change:+.2f}% за {PERIOD_LABELS[period]}',
+        input_message_content=InputTextMessageContent(f'📈 {summary}\n🔄 Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}')
+    )]
+
+    params = build_plot_params(ticker, time_gap, start_date, end_date, data)
+    # Миниатюра дорисовывается в фоне и попадёт в следующий ответ, даже если в этот не успела
+    chart = asyncio.ensure_future(inline_chart(context, params, data))
+
+    def chart_done(task):
+        # Ошибку миниатюры, которую после INLINE_CHART_WAIT уже никто не ждёт, забираем здесь:
+        # иначе asyncio напишет в лог "Task exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning('Не удалось подготовить миниатюру %s', ticker, exc_info=task.exception())
+
+    chart.add_done_callback(chart_done)
+    try:
+        file_id = await asyncio.wait_for(asyncio.shield(chart), INLINE_CHART_WAIT)
+    except (asyncio.TimeoutError, RenderBusyError, RenderUnavailableError, MoexTimeoutError, TelegramError):
+        return results, False
+    if file_id:
+        results.append(InlineQueryResultCachedPhoto(
+            id=f'chart:{ticker}:{period}',
+            photo_file_id=file_id,
+            title=f'График {ticker} за {PERIOD_LABELS[period]}',
+            caption=params.caption
+        ))
+    return results, True
+
+async def inline_query(update, context):
+    query = update.inline_query
+    answers = context.bot_data['inline']
+    # Пока пользователь печатает "SBER 1y", Telegram присылает запрос на каждую букву: отвечаем только последнему
+    if not await answers.settled(update.effective_user.id, query.id):
+        return
+    parsed = parse_inline_query(query.query)
+    ticker = resolve_ticker(context, parsed[0]) if parsed else None
+    if ticker is None:
+        await query.answer([], cache_time=answers.ttl)
+        return
+    period = parsed[1]
+    try:
+        # Произвольные запросы "@bot XXXX 1y" стоят загрузки с MOEX и отрисовки миниатюры — как нажатие кнопки графика
+        admit(context, update.effective_user.id, answers.peek((ticker, period)))
+    except RateLimitedError:
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+    context.bot_data['prefetch'].record(ticker, period, SEED_INTERVALS[period])
+
+    metrics = context.bot_data['metrics']
+    try:
+        with metrics.stage('inline_query'):
+            results = await asyncio.wait_for(
+                answers.get((ticker, period), lambda: inline_answer(context, ticker, period)),
+                INLINE_TIMEOUT
+            )
+    except (asyncio.TimeoutError, MoexTimeoutError):
+        metrics.inc('inline_timeouts')
+        results = []
+    await query.answer(results, cache_time=answers.ttl, is_personal=False)
+
+async def alert_command(update, context):
+    parsed = parse_alert(' '.join(context.args))
+    if parsed is None:
+        await update.message.reply_text(ALERT_USAGE)
+        return
+    ticker, kind, threshold = parsed
+    try:
+        admit(context, update.effective_user.id, price_cached(context, ticker))
+    except RateLimitedError as e:
+        await update.message.reply_text(f'⏳ {e}.')
+        return
+    try:
+        if not await ticker_exists(context, ticker):
+            await update.message.reply_text(f'❌ Тикер {ticker} не найден.')
+            return
+        price = await last_price(context, ticker)
+    except MoexTimeoutError as e:
+        await update.message.reply_text(f'⚠️ {e}. Попробуйте ещё раз чуть позже.')
+        return
+    if price is None:
+        await update.message.reply_text(f'⚠️ По тикеру {ticker} нет данных.')
+        return
+    if kind == ABOVE and price >= threshold or kind == BELOW and price <= threshold:
+        await update.message.reply_text(f'ℹ️ Цена {ticker} уже {price:g}₽ — уведомление сработало бы сразу.')
+        return
+    try:
+        alert = await context.bot_data['alerts'].add(
+            update.effective_user.id, update.effective_chat.id, ticker, kind, threshold, price
         )
-    buf.close()
+    except ValueError as e:
+        await update.message.reply_text(f'❌ {e}.')
+        return
+    await update.message.reply_text(f'🔔 Уведомление №{alert.id} создано: {alert.describe()}\nТекущая цена: {price:g}₽')
+
+async def alerts_command(update, context):
+    alerts = context.bot_data['alerts'].user_alerts(update.effective_user.id)
+    if not alerts:
+        await update.message.reply_text('🔕 Уведомлений нет.\n\n' + ALERT_USAGE)
+        return
+    await update.message.reply_text('🔔 Ваши уведомления:\n' + '\n'.join(f'№{alert.id} {alert.describe()}' for alert in alerts))
+
+async def unalert_command(update, context):
+    engine = context.bot_data['alerts']
+    ids = {int(arg) for arg in context.args if arg.isdigit()}
+    alerts = [alert for alert in engine.user_alerts(update.effective_user.id) if alert.id in ids]
+    if not alerts:
+        await update.message.reply_text('❌ Уведомление не найдено. Номера — в /alerts')
+        return
+    await engine.remove(alerts)
+    await update.message.reply_text(f'🔕 Удалено уведомлений: {len(alerts)}')
+
+async def touch_session(update, context):
+    context.bot_data['metrics'].inc('updates')
+    if context.user_data is not None:
+        context.user_data.last_seen = time.time()
+
+async def evict_idle_sessions(context):
+    deadline = time.time() - SESSION_IDLE_TTL
+    idle = [user_id for user_id, session in context.application.user_data.items() if session.last_seen < deadline]
+    for user_id in idle:
+        context.application.drop_user_data(user_id)
+
+async def refresh_securities(context):
+    await context.bot_data['securities'].refresh(context.bot_data['moex'])
+
+async def stats(update, context):
+    await update.message.reply_text(context.bot_data['metrics'].summary())
+
+async def profile_next(update, context):
+    context.bot_data['profiler'].arm(update.effective_user.id)
+    await update.message.reply_text('🔬 Следующий запрос графика будет профилирован, отчёт придёт файлом.')
+
+def collapse_key(update):
+    """Ключ схлопывания для PerUserUpdateProcessor: та же кнопка того же пользователя под тем же сообщением"""
+    query = update.callback_query
+    if query is None or query.message is None or query.data is None:
+        return None
+    prefix = next((prefix for prefix in COLLAPSIBLE_CALLBACKS if query.data.startswith(prefix)), None)
+    if prefix is None:
+        return None
+    # В группах под одним сообщением нажимают разные люди — их нажатия не схлопываются друг с другом
+    return update.effective_user.id, query.message.chat.id, query.message.message_id, prefix
+
+def register_gauges(application):
+    bot_data = application.bot_data
+    metrics = bot_data['metrics']
+    processor = application.update_processor
+    metrics.gauge('candle_cache', 'Кеш свечей', lambda: bot_data['candles'].stats())
+    metrics.gauge('chart_cache', 'Кеш графиков', lambda: bot_data['charts'].stats())
+    metrics.gauge('render_pool', 'Очередь отрисовки', lambda: {'pending': bot_data['render'].pending,
+                                                              'running': bot_data['render'].running})
+    metrics.gauge('moex_in_flight', 'Запросы к MOEX в работе', lambda: bot_data['moex'].in_flight)
+    metrics.gauge('updates', 'Обновления Telegram в работе', lambda: {'in_flight': processor.current_concurrent_updates,
+                                                                     'queued': processor.queued,
+                                                                     'collapsed': processor.collapsed})
+    metrics.gauge('sessions', 'Сессии пользователей в памяти', lambda: len(application.user_data))
+    metrics.gauge('alerts', 'Активные уведомления о цене', lambda: len(bot_data['alerts']))
+    metrics.gauge('inline_cache', 'Кеш инлайн-ответов', lambda: bot_data['inline'].stats())
+    metrics.gauge('expensive_work', 'Очередь загрузок и отрисовок', lambda: bot_data['scheduler'].stats())
+    metrics.gauge('rate_limited', 'Отклонённые по лимиту запросы пользователей', lambda: bot_data['limits'].limited)
+
+def create_services(bot_data):
+    """Общие сервисы бота; пул отрисовки создаётся в post_init, когда уже работает цикл событий"""
+    bot_data['metrics'] = Metrics()
+    bot_data['profiler'] = RequestProfiler.from_env()
+    bot_data['moex'] = MoexClient.from_env()
+    bot_data['candles'] = CandleCache.from_env()
+    bot_data['store'] = CandleStore.from_env()
+    bot_data['charts'] = ChartCache.from_env()
+    bot_data['securities'] = SecuritiesIndex()
+    bot_data['prefetch'] = Prefetcher.from_env(warm_chart, seed_tickers=[ticker for _, ticker in COMPANIES])
+    bot_data['alerts'] = AlertEngine.from_env(latest_candles)
+    bot_data['inline'] = InlineAnswers.from_env()
+    bot_data['limits'] = UserRateLimiter.from_env()
+    bot_data['scheduler'] = PriorityScheduler.from_env()
+
+def import_heavy_modules():
+    for name in BACKGROUND_IMPORTS:
+        importlib.import_module(name)
+
+async def warm_up(context):
+    """Прогрев после начала опроса: меню отвечает сразу, а процессы отрисовки и библиотеки данных загружаются в фоне"""
+    await asyncio.gather(context.bot_data['render'].warm_up(), asyncio.to_thread(import_heavy_modules))
+
+async def post_init(application):
+    application.bot_data['render'] = RenderPool.from_env(application.bot_data['metrics'])
+    await application.bot_data['alerts'].load()
+    application.bot_data['metrics_server'] = MetricsServer.from_env(application.bot_data['metrics'])
+    await application.bot_data['metrics_server'].start()
+
+async def post_shutdown(application):
+    await application.bot_data['metrics_server'].stop()
+    application.bot_data['moex'].shutdown()
+    application.bot_data['render'].shutdown()
+    application.bot_data['store'].close()
+    application.bot_data['alerts'].store.close()
 
 def main():
     load_dotenv()
     FINANCE_BOT_TOKEN = os.getenv("FINANCE_BOT_TOKEN")
+    webhook_mode = os.getenv('BOT_MODE', 'polling') == 'webhook'
+    webhook_base = os.getenv('WEBHOOK_URL', '').rstrip('/')
+    if webhook_mode and not webhook_base:
+        # Без внешнего адреса Telegram получил бы вебхук вида "/telegram" и молча не доставлял бы обновления
+        raise SystemExit('BOT_MODE=webhook: задайте WEBHOOK_URL — внешний адрес бота, например https://bot.example.com')
+    
+    application = (
+        Application.builder()
+        .token(FINANCE_BOT_TOKEN)
+        .context_types(ContextTypes(user_data=UserSession))
+        .persistence(SqlitePersistence.from_env())
+        .concurrent_updates(PerUserUpdateProcessor(int(os.getenv('CONCURRENT_UPDATES', 256)), collapse_key=collapse_key))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    create_services(application.bot_data)
+    register_gauges(application)
+    application.job_queue.run_once(warm_up, when=0)
+    # Справочник загружается в фоне сразу после старта и затем периодически обновляется
+    application.job_queue.run_repeating(refresh_securities, interval=SECURITIES_REFRESH_INTERVAL, first=0)
+    application.job_queue.run_repeating(evict_idle_sessions, interval=SESSION_EVICT_INTERVAL)
+    application.job_queue.run_repeating(application.bot_data['alerts'].tick, interval=ALERTS_INTERVAL)
+    application.job_queue.run_repeating(application.bot_data['prefetch'].tick, interval=PREFETCH_TICK_INTERVAL, first=PREFETCH_TICK_INTERVAL)
     
-    application = Application.builder().token(FINANCE_BOT_TOKEN).build()
+    # Отмечаем активность пользователя до остальных обработчиков
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
     
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("alerts", alerts_command))
+    application.add_handler(CommandHandler("unalert", unalert_command))
+    application.add_handler(CommandHandler("stats", stats, filters=filters.User(user_id=ADMIN_IDS)))
+    application.add_handler(CommandHandler("profile", profile_next, filters=filters.User(user_id=ADMIN_IDS)))
     application.add_handler(CallbackQueryHandler(handle_back, pattern='^go_back$'))
     application.add_handler(CallbackQueryHandler(manual_ticker_input, pattern='^manual_ticker_input$'))
     application.add_handler(CallbackQueryHandler(company_list, pattern='^company_list$'))
+    application.add_handler(CallbackQueryHandler(company_search, pattern='^company_search$'))
+    application.add_handler(CallbackQueryHandler(compare_input, pattern='^compare_input$'))
     application.add_handler(CallbackQueryHandler(manual_dates_input, pattern='^manual_dates_input$'))
     application.add_handler(CallbackQueryHandler(handle_ticker, pattern='^ticker_'))
     application.add_handler(CallbackQueryHandler(handle_period, pattern='^period_'))
     application.add_handler(CallbackQueryHandler(handle_time_gap, pattern='^time_gap:'))
     application.add_handler(CallbackQueryHandler(handler_chart_type_change, pattern='^set_chart_type:'))
+    application.add_handler(CallbackQueryHandler(send_full_size, pattern='^full_size$'))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_handler(InlineQueryHandler(inline_query))
     
-    application.run_polling()
+    if webhook_mode:
+        # Локальный HTTP-сервер принимает обновления от Telegram (нужен python-telegram-bot[webhooks])
+        url_path = os.getenv('WEBHOOK_PATH', 'telegram')
+        application.run_webhook(
+            listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', 8443)),
+            url_path=url_path,
+            webhook_url=f"{webhook_base}/{url_path}",
+            secret_token=os.getenv('WEBHOOK_SECRET') or None,
+            max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40)),
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,212 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, сек: от быстрых попаданий в кеш до медленных ответов MOEX
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам: верхняя граница корзины, в которую он попал"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+class Metrics:
+    """Метрики бота: гистограммы длительности этапов, счётчики и показатели, которые снимаются в момент запроса"""
+
+    def __init__(self):
+        self.stages = {}  # этап -> Histogram
+        self.counters = {}
+        self._gauges = {}  # имя -> (описание, функция без аргументов: число или {метка: число})
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, description, func):
+        self._gauges[name] = (description, func)
+
+    def _gauge_values(self):
+        for name, (description, func) in self._gauges.items():
+            try:
+                value = func()
+            except Exception:
+                continue  # сервис ещё не создан или уже остановлен
+            yield name, description, value
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = ['# HELP bot_stage_seconds Длительность этапов обработки запроса',
+                 '# TYPE bot_stage_seconds histogram']
+        for stage, histogram in self.stages.items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'bot_stage_seconds_bucket{_labels({"stage": stage, "le": bound})} {cumulative}')
+            lines.append(f'bot_stage_seconds_bucket{_labels({"stage": stage, "le": "+Inf"})} {histogram.count}')
+            lines.append(f'bot_stage_seconds_sum{_labels({"stage": stage})} {histogram.sum}')
+            lines.append(f'bot_stage_seconds_count{_labels({"stage": stage})} {histogram.count}')
+
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE bot_{name}_total counter')
+            lines.append(f'bot_{name}_total {value}')
+
+        for name, description, value in self._gauge_values():
+            lines.append(f'# HELP bot_{name} {description}')
+            lines.append(f'# TYPE bot_{name} gauge')
+            if isinstance(value, dict):
+                for label, item in value.items():
+                    lines.append(f'bot_{name}{_labels({"kind": label})} {item}')
+            else:
+                lines.append(f'bot_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Краткая сводка для команды /stats"""
+        lines = ['⏱ Этапы (p50 / p99 / число):']
+        for stage, histogram in sorted(self.stages.items()):
+            lines.append(f'  {stage}: {histogram.quantile(0.5):g} / {histogram.quantile(0.99):g} с / {histogram.count}')
+        if self.counters:
+            lines.append('🔢 Счётчики:')
+            lines.extend(f'  {name}: {value}' for name, value in sorted(self.counters.items()))
+        lines.append('📦 Состояние:')
+        for name, _, value in self._gauge_values():
+            if isinstance(value, dict):
+                value = ', '.join(f'{label}={item:.3g}' if isinstance(item, float) else f'{label}={item}'
+                                  for label, item in value.items())
+            lines.append(f'  {name}: {value}')
+        return '\n'.join(lines)
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер на asyncio: отдаёт метрики по GET /metrics"""
+
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @classmethod
+    def from_env(cls, metrics):
+        return cls(metrics, host=os.getenv('METRICS_HOST', '127.0.0.1'), port=int(os.getenv('METRICS_PORT', 0)))
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Заголовки не нужны, но их надо дочитать до пустой строки
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.metrics.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        if self.port:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+class RequestProfiler:
+    """Профилирование одного запроса по команде администратора: cProfile или pyinstrument, если установлен"""
+
+    def __init__(self, backend='cprofile'):
+        self.backend = backend
+        self._armed = set()
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('PROFILER', 'cprofile'))
+
+    def arm(self, user_id):
+        self._armed.add(user_id)
+
+    @contextmanager
+    def profile(self, user_id):
+        """Профилирует блок, если для пользователя включено профилирование; отчёт — в result['report']"""
+        result = {}
+        if user_id not in self._armed:
+            yield result
+            return
+        self._armed.discard(user_id)
+
+        # Профилировщик видит весь цикл событий, поэтому параллельные запросы тоже попадут в отчёт
+        if self.backend == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode='enabled')
+            profiler.start()
+            try:
+                yield result
+            finally:
+                profiler.stop()
+                result['report'] = profiler.output_text(unicode=True)
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield result
+            finally:
+                profiler.disable()
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+                result['report'] = out.getvalue()
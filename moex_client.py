@@ -0,0 +1,87 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from rate_limit import TokenBucket
+from securities import fetch_securities
+
+
+def _ticker(ticker):
+    # moexalgo тянет pandas: импортируется в потоке пула при первом запросе, а не при старте бота
+    from moexalgo import Ticker
+    return Ticker(ticker)
+
+
+class MoexTimeoutError(Exception):
+    pass
+
+
+class MoexClient:
+    """Асинхронный доступ к moexalgo: синхронные запросы выполняются в ограниченном пуле потоков"""
+
+    def __init__(self, max_workers=8, max_concurrent=None, timeout=30.0, rate=0.0, burst=10):
+        self.timeout = timeout
+        # Общий лимит частоты запросов к MOEX (запросов в секунду); 0 — без лимита
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='moex')
+        self._semaphore = asyncio.Semaphore(max_concurrent or max_workers)
+        self.in_flight = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_workers=int(os.getenv('MOEX_WORKERS', 8)),
+            max_concurrent=int(os.getenv('MOEX_MAX_CONCURRENT', 0)) or None,
+            timeout=float(os.getenv('MOEX_TIMEOUT', 30)),
+            rate=float(os.getenv('MOEX_RATE', 0)),
+            burst=int(os.getenv('MOEX_BURST', 10)),
+        )
+
+    def _finished(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def _call(self, func, timeout=None):
+        if self._bucket is not None:
+            # Сверх лимита запросы ждут, а не отклоняются: пользователь получит график чуть позже
+            await self._bucket.take()
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(func)
+        except BaseException:
+            self._finished()
+            raise
+
+        # Слот освобождается только когда поток действительно закончил работу,
+        # иначе после таймаутов в пуле копились бы "зависшие" запросы
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._finished)
+            except RuntimeError:
+                pass  # цикл событий уже закрыт
+
+        future.add_done_callback(release)
+        try:
+            # Отмена ожидающей задачи отменяет и ещё не начатый запрос в пуле
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise MoexTimeoutError(f'MOEX не ответила за {timeout or self.timeout:.0f} с') from None
+
+    async def ticker(self, ticker, timeout=None):
+        return await self._call(partial(_ticker, ticker), timeout)
+
+    async def candles(self, ticker, start, end, period, timeout=None):
+        def fetch():
+            return _ticker(ticker).candles(start=start, end=end, period=period)
+
+        return await self._call(fetch, timeout)
+
+    async def securities(self, timeout=None):
+        return await self._call(partial(fetch_securities, timeout or self.timeout), timeout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,174 @@
+import time
+from io import BytesIO
+
+import matplotlib
+import matplotlib.style
+import numpy as np
+from matplotlib import font_manager
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import pandas as pd
+from mplfinance.original_flavor import candlestick_ohlc
+from PIL import Image
+
+from image_profile import FULL_RESOLUTION
+from indicators import heikin_ashi
+from ru_text import format_days_human
+
+
+def converter_to_heikin_ashi_dataframe(df):
+    ha_open, ha_high, ha_low, ha_close = heikin_ashi(df['open'].values, df['high'].values,
+                                                     df['low'].values, df['close'].values)
+
+    ha_df = pd.DataFrame({
+        'begin': df['begin'],
+        'open': ha_open,
+        'high': ha_high,
+        'low': ha_low,
+        'close': ha_close
+    })
+    return ha_df
+
+class ChartRenderer:
+    """Отрисовка графиков через Figure/Agg без pyplot: стиль и шрифты загружаются один раз, фигура переиспользуется"""
+
+    def __init__(self, figsize=(15, 7), dpi=300):
+        # rcParams читаются при создании фигуры и осей, поэтому стиль задаём до них и только один раз
+        matplotlib.style.use('seaborn-v0_8-darkgrid')
+        matplotlib.rcParams['font.family'] = 'Times New Roman'
+        # Прогреваем кеш поиска шрифтов, чтобы первый график не тратил на это время
+        font_manager.findfont(font_manager.FontProperties(family='Times New Roman'))
+        self.dpi = dpi
+        self.fig = Figure(figsize=figsize)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        # Длительность этапов последней отрисовки, сек: построение графика и растеризация в PNG
+        self.timings = {}
+
+    def encode(self, profile=None):
+        """Сохраняет фигуру в PNG или WebP по профилю; DPI подбирается под целевую ширину"""
+        profile = profile or FULL_RESOLUTION
+        dpi = profile.width / self.fig.get_figwidth() if profile.width else self.dpi
+        buf = BytesIO()
+        if profile.format == 'webp':
+            self.fig.savefig(buf, format='webp', dpi=dpi, bbox_inches='tight', pil_kwargs={'quality': profile.quality})
+        elif profile.colors:
+            # Без сжатия: PNG тут же распаковывается, квантуется до палитры и сжимается один раз
+            raw = BytesIO()
+            self.fig.savefig(raw, format='png', dpi=dpi, bbox_inches='tight', pil_kwargs={'compress_level': 0})
+            raw.seek(0)
+            image = Image.open(raw).convert('RGB').quantize(profile.colors, method=Image.Quantize.FASTOCTREE)
+            image.save(buf, format='png', compress_level=profile.compression)
+        else:
+            self.fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight',
+                             pil_kwargs={'compress_level': profile.compression})
+        buf.seek(0)
+        return buf
+
+    def render(self, df, ticker, start_date, end_date, date_type, date_delta, chart_type='line', n_points=None,
+               profile=None, series=()):
+        started = time.perf_counter()
+        if date_delta >= 1:
+            part_header_time_gap = f'{start_date.strftime('%d.%m.%y')} - {end_date.strftime('%d.%m.%y')}'
+        else:
+            part_header_time_gap = f'{start_date.strftime('%d.%m.%y')}'
+
+        if date_delta <= 3:
+            x_date_format = '%d.%m %H:%M'
+        elif date_delta <= 90:
+            x_date_format = '%d.%m.%y'
+        else:
+            x_date_format = '%b %Y'
+
+        # Не изменяем исходный DataFrame: он может лежать в общем кеше свечей.
+        # Прореженный ряд приходит с исходными позициями точек в колонке x
+        x = df['x'].values if 'x' in df else np.arange(len(df))
+        df = df.assign(begin=pd.to_datetime(df['begin']), x=x)
+
+        ax = self.ax
+        ax.clear()
+
+        if chart_type == 'line':
+            # плавающие гиперпараметры (line)
+            if len(df) >= 500:
+                linewidth = 1.7
+            elif len(df) >= 1000:
+                linewidth = 1.3
+            elif len(df) >= 2000:
+                linewidth = 1.1
+            elif len(df) >= 4000:
+                linewidth = 0.9
+            else:
+                linewidth = 2
+
+            x = df['x'].values
+            y = df['open'].values
+
+            # Основной график
+            ax.plot(x, y,
+                    linewidth=linewidth,
+                    color="#3d69b7",
+                    label='Цена открытия')
+            ax.legend(fontsize=12)
+
+        elif chart_type == 'candles':
+            quotes = df[['x', 'open', 'high', 'low', 'close']].astype(float).values
+            candlestick_ohlc(ax, quotes, width=0.6,
+                             colorup='green', colordown='red', alpha=0.8)
+
+        elif chart_type == 'heiken-ashi':
+            ha_df = converter_to_heikin_ashi_dataframe(df)
+            ha_df['x'] = range(len(ha_df))
+            quotes = ha_df[['x', 'open', 'high', 'low', 'close']].astype(float).values
+            candlestick_ohlc(ax, quotes, width=0.6,
+                             colorup='green', colordown='red', alpha=0.8)
+
+        elif chart_type == 'compare':
+            # series — колонки с доходностью каждой бумаги от начала периода, %
+            for name in series:
+                ax.plot(df['x'].values, df[name].values, linewidth=1.7, label=name)
+            ax.axhline(0, color='grey', linewidth=1)
+            ax.legend(fontsize=12)
+
+        if chart_type == 'compare':
+            title_tail = 'Доходность: ' + ', '.join(f'{name} {df.iloc[-1][name]:+.1f}%' for name in series)
+            y_label = 'Доходность (%)'
+        else:
+            title_tail = f'Последняя цена: {df.iloc[-1]["close"]:.1f}₽'
+            y_label = 'Цена (₽)'
+
+        ax.set_title(f'{ticker} | {part_header_time_gap} | {format_days_human(date_delta)} ({n_points or len(df)} точек) | {title_tail}',
+                     fontsize=20, pad=20, fontweight='bold')
+        ax.set_xlabel('Дата', fontsize=16)
+        ax.set_ylabel(y_label, fontsize=16)
+
+        # Отображаем подписи дат на оси X с шагом
+        step_x = max(len(df) // 10, 1)
+        xticks = df['x'][::step_x]
+        xticklabels = df['begin'].dt.strftime(x_date_format)[::step_x]
+
+        ax.grid(True, alpha=0.4)
+        ax.set_xticks(xticks)
+        ax.set_xticklabels(xticklabels, rotation=45)
+        self.fig.tight_layout()
+
+        drawn = time.perf_counter()
+        buf = self.encode(profile)
+        self.timings = {'render': drawn - started, 'encode': time.perf_counter() - drawn}
+        # Освобождаем данные графика до следующей отрисовки
+        ax.clear()
+
+        return buf
+
+_renderer = None
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = ChartRenderer()
+    return _renderer
+
+def paint_plot(df, ticker, start_date, end_date, date_type, date_delta, chart_type='line', n_points=None, profile=None,
+               series=()):
+    return get_renderer().render(df, ticker, start_date, end_date, date_type, date_delta, chart_type, n_points, profile,
+                                 series)
@@ -0,0 +1,125 @@
+import logging
+import os
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo
+
+from candle_cache import TTL_BY_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+# Утренняя, основная и вечерняя сессии фондового рынка MOEX по будням
+TRADING_HOURS = (dtime(6, 50), dtime(23, 50))
+INTRADAY_INTERVALS = {'1min', '10min', '1h'}
+
+PERIOD_DAYS = {
+    '1day': 1,
+    '1month': 30,
+    '1year': 365,
+    '5years': 5 * 365,
+}
+# Интервал, который чаще всего выбирают для пресета: им прогреваем кеш до первых запросов
+SEED_INTERVALS = {
+    '1day': '10min',
+    '1month': '1h',
+    '1year': '1d',
+    '5years': '1w',
+}
+
+# Популярность запросов убывает вдвое примерно за 12 часов (при тике раз в минуту)
+DECAY = 0.999
+MIN_SCORE = 0.01
+
+
+def preset_dates(period, today=None):
+    end_date = today or date.today()
+    return end_date - timedelta(days=PERIOD_DAYS[period]), end_date
+
+
+def is_trading_time(now=None):
+    now = (now or datetime.now(MOSCOW)).astimezone(MOSCOW)
+    return now.weekday() < 5 and TRADING_HOURS[0] <= now.time() <= TRADING_HOURS[1]
+
+
+def off_hours_ttl(interval, now=None):
+    """Срок жизни внутридневных свечей вне торговых часов — до открытия следующей сессии; None в торговые часы"""
+    now = (now or datetime.now(MOSCOW)).astimezone(MOSCOW)
+    if interval not in INTRADAY_INTERVALS or is_trading_time(now):
+        return None
+    day = now.date() + timedelta(days=now.time() >= TRADING_HOURS[0])
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return (datetime.combine(day, TRADING_HOURS[0], MOSCOW) - now).total_seconds()
+
+
+class Prefetcher:
+    """Прогревает кеши для самых популярных сочетаний (тикер, пресет периода, интервал)"""
+
+    def __init__(self, warm, top_n=20, prerender=False, seed_tickers=()):
+        # warm(context, ticker, period, interval, prerender) загружает свечи и при необходимости рисует график
+        self.warm = warm
+        self.top_n = top_n
+        self.prerender = prerender
+        self.scores = {}
+        self._warmed_at = {}
+        self._settled = set()  # внутридневные сочетания, прогретые после закрытия торгов до следующей сессии
+        for ticker in seed_tickers:
+            for period, interval in SEED_INTERVALS.items():
+                self.scores[(ticker, period, interval)] = MIN_SCORE * 10
+
+    @classmethod
+    def from_env(cls, warm, seed_tickers=()):
+        return cls(
+            warm,
+            top_n=int(os.getenv('PREFETCH_TOP', 20)),
+            prerender=os.getenv('PREFETCH_PRERENDER', '0') == '1',
+            seed_tickers=seed_tickers,
+        )
+
+    def record(self, ticker, period, interval):
+        key = (ticker, period, interval)
+        self.scores[key] = self.scores.get(key, 0) + 1
+
+    def _decay(self):
+        for key in list(self.scores):
+            self.scores[key] *= DECAY
+            if self.scores[key] < MIN_SCORE:
+                del self.scores[key]
+                self._warmed_at.pop(key, None)
+                self._settled.discard(key)
+
+    def due(self, now=None):
+        """Популярные сочетания, которые пора обновить: каденция равна TTL интервала в кеше свечей"""
+        now = now or time.monotonic()
+        trading = is_trading_time()
+        if trading:
+            self._settled.clear()
+        popular = sorted(self.scores, key=self.scores.get, reverse=True)[:self.top_n]
+        result = []
+        for key in popular:
+            interval = key[2]
+            warmed_at = self._warmed_at.get(key)
+            # Вне торговых часов внутридневные свечи не меняются: достаточно прогреть один раз после закрытия,
+            # warm сохранит их в кеше до открытия следующей сессии (off_hours_ttl)
+            if not trading and interval in INTRADAY_INTERVALS:
+                if key not in self._settled:
+                    result.append(key)
+                continue
+            # Обновляем немного раньше истечения записи, чтобы пользователь не попал на промах
+            if warmed_at is None or now - warmed_at >= TTL_BY_INTERVAL[interval] * 0.8:
+                result.append(key)
+        return result
+
+    async def tick(self, context):
+        self._decay()
+        for key in self.due():
+            ticker, period, interval = key
+            try:
+                await self.warm(context, ticker, period, interval, self.prerender)
+            except Exception:
+                logger.exception('Не удалось прогреть кеш для %s', key)
+            # Время фиксируем и при ошибке, чтобы не повторять неудачный запрос каждую минуту
+            self._warmed_at[key] = time.monotonic()
+            if interval in INTRADAY_INTERVALS and not is_trading_time():
+                self._settled.add(key)
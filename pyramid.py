@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+# Дерево уровней: из каких интервалов агрегируется каждый более мелкий.
+# Недели и месяцы строятся из дней: неделя пересекает границу месяца, поэтому месяц из недель собрать нельзя
+COARSER = {
+    '1min': ['10min'],
+    '10min': ['1h'],
+    '1h': ['1d'],
+    '1d': ['1w', '1m'],
+}
+RESAMPLE_RULES = {
+    '10min': '10min',
+    '1h': '1h',
+    '1d': '1D',
+    '1w': 'W-MON',
+    '1m': 'MS',
+}
+AGGREGATIONS = {
+    'open': 'first',
+    'close': 'last',
+    'high': 'max',
+    'low': 'min',
+    'value': 'sum',
+    'volume': 'sum',
+    'end': 'max',
+}
+
+
+def coarser(interval):
+    """Интервалы, которые строятся непосредственно из свечей interval"""
+    return COARSER.get(interval, [])
+
+
+def period_start(interval, day):
+    if interval == '1w':
+        return day - timedelta(days=day.weekday())
+    if interval == '1m':
+        return day.replace(day=1)
+    return day
+
+
+def period_end(interval, day):
+    if interval == '1w':
+        return day + timedelta(days=6 - day.weekday())
+    if interval == '1m':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return day
+
+
+def whole_periods(interval, start, end):
+    """Наибольший отрезок внутри [start, end], состоящий из целых недель/месяцев (для дней и мельче — сам отрезок)"""
+    if period_start(interval, start) != start:
+        start = period_end(interval, start) + timedelta(days=1)
+    if period_end(interval, end) != end:
+        end = period_start(interval, end) - timedelta(days=1)
+    return (start, end) if start <= end else None
+
+
+def resample_ohlc(df, interval):
+    """Свечи интервала interval из более мелких свечей (совпадают с биржевыми, если мелкие свечи полные)"""
+    if df.empty:
+        return df
+    bars = df.resample(RESAMPLE_RULES[interval], on='begin', label='left', closed='left').agg(AGGREGATIONS)
+    # Пустые корзины (ночь, выходные) — не свечи
+    bars = bars.dropna(subset=['open']).reset_index()
+    return bars[df.columns]
@@ -0,0 +1,136 @@
+import asyncio
+import heapq
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from itertools import count
+
+# Приоритеты дорогой работы: меньше — раньше. Ответы из кешей и правки меню через очередь не идут
+RENDER = 0  # свечи уже в кеше, нужна только отрисовка
+FETCH = 1  # нужен запрос к MOEX и отрисовка
+BACKGROUND = 2  # прогрев кешей: никогда не обгоняет запросы пользователей
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Слишком много запросов, повторите через {math.ceil(retry_after)} с')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше burst в запасе"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost=1):
+        """Через сколько секунд хватит маркеров на cost (0 — уже хватает)"""
+        self._refill()
+        return max(cost - self.tokens, 0) / self.rate
+
+    def try_take(self, cost=1):
+        if self.wait_time(cost):
+            return False
+        self.tokens -= cost
+        return True
+
+    async def take(self, cost=1):
+        """Ждёт маркеры: для внешнего API запрос лучше задержать, чем отклонить"""
+        while not self.try_take(cost):
+            await asyncio.sleep(self.wait_time(cost))
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class UserRateLimiter:
+    """Отдельное ведро на каждого пользователя; полные ведра неактивных пользователей вытесняются"""
+
+    def __init__(self, rate, burst, max_users=10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.limited = 0
+        self._buckets = OrderedDict()  # id пользователя -> TokenBucket
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rate=float(os.getenv('USER_RATE_PER_MIN', 20)) / 60,  # 0 — без лимита
+            burst=int(os.getenv('USER_BURST', 5)),
+        )
+
+    def check(self, user_id, cost=1):
+        """Списывает cost маркеров или бросает RateLimitedError со временем до следующей попытки"""
+        if not self.rate:
+            return
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_users and self._buckets[next(iter(self._buckets))].full:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+        if not bucket.try_take(cost):
+            self.limited += 1
+            raise RateLimitedError(bucket.wait_time(cost))
+
+
+class PriorityScheduler:
+    """Не больше slots дорогих задач одновременно; ожидающие запускаются по приоритету, внутри приоритета — по очереди"""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.running = 0
+        self._waiting = []  # куча (приоритет, номер, future)
+        self._order = count()
+
+    @classmethod
+    def from_env(cls):
+        return cls(int(os.getenv('EXPENSIVE_SLOTS', 0)) or 2 * (os.cpu_count() or 1))
+
+    @property
+    def waiting(self):
+        return sum(not future.done() for _, _, future in self._waiting)
+
+    def _release(self):
+        # Слот переходит первому живому ожидающему, не освобождаясь: новая задача не проскочит вперёд очереди
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority):
+        if self.running < self.slots and not self.waiting:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (priority, next(self._order), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Отменили уже после передачи слота — возвращаем его следующему
+                if future.done() and not future.cancelled():
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        return {'running': self.running, 'waiting': self.waiting}
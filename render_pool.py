@@ -0,0 +1,127 @@
+import asyncio
+import locale
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Колонки, которые нужны для отрисовки: остальное не передаём в рабочий процесс
+PLOT_COLUMNS = ['begin', 'open', 'high', 'low', 'close', 'x']
+
+
+class RenderBusyError(Exception):
+    pass
+
+
+class RenderUnavailableError(Exception):
+    """Рабочие процессы не запускаются или падают раз за разом: это не перегрузка, повтор запроса не поможет"""
+
+
+def _init_worker():
+    # matplotlib и локаль (русские месяцы на осях) нужны только рабочим процессам:
+    # основной процесс бота их не загружает
+    import plotting
+    try:
+        locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
+    except locale.Error:
+        # Без русской локали графики всё равно строятся, только месяцы на осях подписаны по-английски
+        logger.warning('Локаль ru_RU.UTF-8 не установлена: подписи месяцев будут на английском')
+    # Стиль, шрифты и фигура готовятся один раз на процесс
+    plotting.get_renderer()
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _render(df, kwargs):
+    import plotting
+    png = plotting.paint_plot(df, **kwargs).getvalue()
+    return png, plotting.get_renderer().timings
+
+
+class RenderPool:
+    """Пул процессов для отрисовки графиков: matplotlib не блокирует цикл событий и не делит глобальное состояние pyplot"""
+
+    def __init__(self, workers=None, max_queue=32, metrics=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.metrics = metrics
+        self.pending = 0
+        self.running = 0
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._executor = self._create_executor()
+        self._healthy = False  # текущий пул уже выполнил хотя бы одну задачу
+
+    @classmethod
+    def from_env(cls, metrics=None):
+        return cls(
+            workers=int(os.getenv('RENDER_WORKERS', 0)) or None,
+            max_queue=int(os.getenv('RENDER_QUEUE', 32)),
+            metrics=metrics,
+        )
+
+    def _create_executor(self):
+        # spawn: fork процесса с работающими потоками и циклом событий небезопасен
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        )
+
+    async def warm_up(self):
+        """Запускает все рабочие процессы заранее, чтобы первый график не ждал импорта matplotlib"""
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        await asyncio.gather(*[loop.run_in_executor(executor, _warm_up) for _ in range(self.workers)])
+        self._healthy = self._healthy or self._executor is executor
+
+    async def render(self, df, **kwargs):
+        """Отрисовывает график в отдельном процессе и возвращает PNG в байтах"""
+        if self.pending >= self.workers + self.max_queue:
+            raise RenderBusyError('Слишком много графиков в очереди')
+        self.pending += 1
+        queued = time.perf_counter()
+        try:
+            async with self._semaphore:
+                self.running += 1
+                executor = self._executor
+                try:
+                    loop = asyncio.get_running_loop()
+                    columns = df.columns.intersection([*PLOT_COLUMNS, *kwargs.get('series', ())])
+                    future = loop.run_in_executor(executor, _render, df[columns], kwargs)
+                    if self.metrics is not None:
+                        self.metrics.observe('render_queue', time.perf_counter() - queued)
+                    png, timings = await future
+                    self._healthy = self._healthy or self._executor is executor
+                    if self.metrics is not None:
+                        for stage, seconds in timings.items():
+                            self.metrics.observe(stage, seconds)
+                    return png
+                except BrokenProcessPool as e:
+                    # Упавший процесс ломает весь пул: пересоздаём его для следующих задач
+                    healthy = self._healthy
+                    if self._executor is executor:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        self._executor = self._create_executor()
+                        self._healthy = False
+                        if self.metrics is not None:
+                            self.metrics.inc('render_restarts')
+                    if not healthy:
+                        # Пул не выполнил ни одной задачи: скорее всего, процессы падают при запуске (initializer),
+                        # и следующая попытка упадёт так же
+                        logger.error('Пул отрисовки не выполнил ни одной задачи и упал: %s', e)
+                        raise RenderUnavailableError('Построение графиков сейчас недоступно') from e
+                    # Процесс упал на отдельном графике работавшего пула: для пользователя это временный сбой
+                    raise RenderBusyError('Процесс отрисовки перезапущен') from e
+                finally:
+                    self.running -= 1
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,38 @@
+def plural_day_ru(n):
+    n = abs(n) % 100
+    n1 = n % 10
+
+    if 11 <= n <= 19:
+        return "дней"
+    elif n1 == 1:
+        return "день"
+    elif 2 <= n1 <= 4:
+        return "дня"
+    else:
+        return "дней"
+
+def type_gap_to_ru(s):
+    dict_type_to_rus = {
+        '1min': 'минутный',
+        '10min': '10-минутный',
+        '1h': 'часовой',
+        '1d': 'дневной',
+        '1w': 'недельный',
+        '1m': 'месячный',
+    }
+    return dict_type_to_rus[s]
+
+def format_days_human(n_days):
+    if n_days >= 365 * 2:
+        years = n_days // 365
+        return f"{years} {'года' if 2 <= years <= 4 else 'лет'}"
+    elif n_days >= 60:
+        months = n_days // 30
+        return f"{months} {'месяца' if 2 <= months <= 4 else 'месяцев'}"
+    elif n_days >= 7:
+        weeks = n_days // 7
+        return f"{weeks} {'недели' if 2 <= weeks <= 4 else 'недель'}"
+    elif n_days == 0:
+        return "1 день"
+    else:
+        return f"{n_days} {'день' if n_days == 1 else 'дня' if 2 <= n_days <= 4 else 'дней'}"
@@ -0,0 +1,144 @@
+import difflib
+import json
+import re
+from bisect import bisect_left
+from typing import NamedTuple
+from urllib.request import urlopen
+
+ISS_SECURITIES_URL = (
+    'https://iss.moex.com/iss/engines/stock/markets/{market}/securities.json'
+    '?iss.meta=off&iss.only=securities&securities.columns={columns}'
+)
+# Рынки справочника: акции и индексы (IMOEX, RTSI). У индексов нет лота и статуса, а полное название — в NAME
+MARKET_COLUMNS = {
+    'shares': 'SECID,BOARDID,SHORTNAME,SECNAME,LOTSIZE,STATUS',
+    'index': 'SECID,BOARDID,SHORTNAME,NAME',
+}
+# Основной режим торгов акциями: если бумага торгуется в нескольких режимах, берём его
+PRIMARY_BOARD = 'TQBR'
+
+
+class Security(NamedTuple):
+    ticker: str
+    name: str
+    full_name: str
+    board: str
+    lot: int
+    status: str
+
+    @property
+    def is_trading(self):
+        return self.status == 'A'
+
+
+def fetch_securities(timeout=30):
+    """Список акций и индексов из ISS MOEX (синхронно, для пула потоков)"""
+    rows = []
+    for market, columns in MARKET_COLUMNS.items():
+        with urlopen(ISS_SECURITIES_URL.format(market=market, columns=columns), timeout=timeout) as response:
+            payload = json.load(response)['securities']
+        rows.extend(dict(zip(payload['columns'], row)) for row in payload['data'])
+    return rows
+
+
+def normalize(text):
+    text = text.lower().replace('ё', 'е')
+    return re.sub(r'[^\w\s-]', ' ', text).strip()
+
+
+class SecuritiesIndex:
+    """Локальный справочник бумаг MOEX: проверка тикера за O(1), поиск по префиксу и нечёткий поиск по названию"""
+
+    def __init__(self):
+        self.loaded = False
+        self._by_ticker = {}
+        self._tickers = []
+        self._words = []  # отсортированные пары (слово названия, тикер)
+        self._names = {}  # нормализованное название -> тикер
+        self._sorted_names = []
+
+    def load(self, rows):
+        by_ticker = {}
+        for row in rows:
+            ticker = row['SECID']
+            if ticker in by_ticker and row['BOARDID'] != PRIMARY_BOARD:
+                continue
+            by_ticker[ticker] = Security(
+                ticker=ticker,
+                name=row.get('SHORTNAME') or ticker,
+                full_name=row.get('SECNAME') or row.get('NAME') or '',
+                board=row['BOARDID'],
+                lot=int(row.get('LOTSIZE') or 1),
+                status=row.get('STATUS') or '',
+            )
+
+        words = set()
+        names = {}
+        for security in by_ticker.values():
+            for name in (security.name, security.full_name):
+                normalized = normalize(name)
+                if normalized:
+                    names.setdefault(normalized, security.ticker)
+                    words.update((word, security.ticker) for word in normalized.split())
+
+        # Новые структуры подменяют старые целиком: поиск не видит наполовину обновлённый индекс
+        self._by_ticker = by_ticker
+        self._tickers = sorted(by_ticker)
+        self._words = sorted(words)
+        self._names = names
+        self._sorted_names = sorted(names)
+        self.loaded = True
+
+    def __len__(self):
+        return len(self._by_ticker)
+
+    def __contains__(self, ticker):
+        return ticker in self._by_ticker
+
+    def get(self, ticker):
+        return self._by_ticker.get(ticker)
+
+    def _prefix(self, items, prefix, key=lambda item: item):
+        start = bisect_left(items, prefix, key=key)
+        for item in items[start:]:
+            if not key(item).startswith(prefix):
+                break
+            yield item
+
+    def _fuzzy(self, name_query, limit):
+        # Генератор: нечёткий поиск дороже остальных и выполняется, только если совпадений не хватило
+        for name in difflib.get_close_matches(name_query, self._names, n=limit, cutoff=0.6):
+            yield self._names[name]
+
+    def search(self, query, limit=8):
+        """Бумаги по тикеру или названию: точное совпадение, префиксы, затем нечёткое совпадение"""
+        ticker_query = query.strip().upper()
+        name_query = normalize(query)
+        if not ticker_query:
+            return []
+
+        candidates = []
+        if ticker_query in self._by_ticker:
+            candidates.append([ticker_query])
+        if name_query:
+            candidates.append(self._names[name] for name in self._prefix(self._sorted_names, name_query))
+        candidates.append(self._prefix(self._tickers, ticker_query))
+        if name_query:
+            first_word = name_query.split()[0]
+            candidates.append(ticker for _, ticker in self._prefix(self._words, first_word, key=lambda item: item[0]))
+            candidates.append(self._fuzzy(name_query, limit))
+
+        found = []
+        for tickers in candidates:
+            for ticker in tickers:
+                if ticker not in found:
+                    found.append(ticker)
+                if len(found) >= limit:
+                    return self._securities(found)
+        return self._securities(found)
+
+    def _securities(self, tickers):
+        return [self._by_ticker[ticker] for ticker in tickers]
+
+    async def refresh(self, moex):
+        self.load(await moex.securities())
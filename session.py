@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from datetime import date
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Глубже пользователь по кнопке "Назад" не возвращается
+HISTORY_LIMIT = 16
+
+
+@dataclass(slots=True)
+class PlotParams:
+    """Параметры последнего графика: сами свечи и картинки лежат в общих кешах"""
+    ticker: str
+    start_date: date
+    end_date: date
+    date_type: str
+    date_delta: int
+    caption: str
+    # Запрошенный период — ключ свечей в кеше (start_date/end_date могут быть сужены до фактических данных)
+    request_start: date
+    request_end: date
+
+    def to_dict(self):
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        for name in ('start_date', 'end_date', 'request_start', 'request_end'):
+            data[name] = data[name].isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        for name in ('start_date', 'end_date', 'request_start', 'request_end'):
+            data[name] = date.fromisoformat(data[name])
+        return cls(**data)
+
+
+@dataclass(slots=True)
+class UserSession:
+    """Состояние диалога пользователя (context.user_data)"""
+    ticker: str = ''
+    # Несколько тикеров в режиме сравнения; пустой список — обычный график одного тикера
+    tickers: list = field(default_factory=list)
+    start_date: date | None = None
+    end_date: date | None = None
+    period: str = ''
+    time_gap: str = '1d'
+    chart_type: str = 'line'
+    awaiting_input_type: str | None = None
+    plot: PlotParams | None = None
+    history_steps: deque = field(default_factory=lambda: deque(maxlen=HISTORY_LIMIT))
+    last_seen: float = field(default_factory=time.time)
+
+    def push_step(self, step):
+        if not self.history_steps or self.history_steps[-1] != step:
+            self.history_steps.append(step)
+
+    def to_dict(self):
+        return {
+            'ticker': self.ticker,
+            'tickers': self.tickers,
+            'start_date': self.start_date and self.start_date.isoformat(),
+            'end_date': self.end_date and self.end_date.isoformat(),
+            'period': self.period,
+            'time_gap': self.time_gap,
+            'chart_type': self.chart_type,
+            'awaiting_input_type': self.awaiting_input_type,
+            'plot': self.plot and self.plot.to_dict(),
+            'history_steps': list(self.history_steps),
+            'last_seen': self.last_seen,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        session = cls(
+            ticker=data['ticker'],
+            tickers=data.get('tickers', []),
+            start_date=data['start_date'] and date.fromisoformat(data['start_date']),
+            end_date=data['end_date'] and date.fromisoformat(data['end_date']),
+            period=data['period'],
+            time_gap=data['time_gap'],
+            chart_type=data['chart_type'],
+            awaiting_input_type=data['awaiting_input_type'],
+            plot=data['plot'] and PlotParams.from_dict(data['plot']),
+            last_seen=data['last_seen'],
+        )
+        session.history_steps.extend(data['history_steps'])
+        return session
+
+
+class SqlitePersistence(BasePersistence):
+    """Хранит сессии пользователей в SQLite в виде JSON (без pickle и DataFrame)"""
+
+    def __init__(self, path='sessions.sqlite3', update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sessions')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('SESSION_DB_PATH', 'sessions.sqlite3'))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load(self):
+        rows = self._conn.execute('SELECT user_id, data FROM sessions').fetchall()
+        return {user_id: UserSession.from_dict(json.loads(data)) for user_id, data in rows}
+
+    def _save(self, user_id, data):
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?)', (user_id, data))
+
+    def _delete(self, user_id):
+        with self._conn:
+            self._conn.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+
+    async def get_user_data(self):
+        return await self._run(self._load)
+
+    async def update_user_data(self, user_id, data):
+        await self._run(self._save, user_id, json.dumps(data.to_dict(), ensure_ascii=False))
+
+    async def drop_user_data(self, user_id):
+        await self._run(self._delete, user_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def flush(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,110 @@
+import asyncio
+import math
+import os
+from datetime import timedelta
+
+from downsample import LINE_MAX_POINTS
+
+# Примерное число свечей за торговый день: по нему решаем, грузить ли период частями
+ROWS_PER_DAY = {'1min': 540, '10min': 54, '1h': 9}
+INTERVAL_LENGTH = {'1min': timedelta(minutes=1), '10min': timedelta(minutes=10), '1h': timedelta(hours=1)}
+
+# Периоды длиннее этого числа свечей загружаются частями и сразу сворачиваются
+STREAM_MIN_ROWS = int(os.getenv('STREAM_MIN_ROWS', 20_000))
+CHUNK_ROWS = 5_000
+STREAM_PARALLEL = int(os.getenv('STREAM_PARALLEL', 3))
+
+
+def should_stream(interval, start, end):
+    return interval in ROWS_PER_DAY and ((end - start).days + 1) * ROWS_PER_DAY[interval] > STREAM_MIN_ROWS
+
+
+def chunk_ranges(interval, start, end):
+    days = max(CHUNK_ROWS // ROWS_PER_DAY[interval], 1)
+    ranges = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=days - 1), end)
+        ranges.append((start, chunk_end))
+        start = chunk_end + timedelta(days=1)
+    return ranges
+
+
+def bin_size(interval, start, end, max_points):
+    """Длина интервала агрегации, кратная интервалу свечей, чтобы за период вышло не больше max_points точек"""
+    step = INTERVAL_LENGTH[interval]
+    total = timedelta(days=(end - start).days + 1)
+    return step * max(math.ceil(total / step / max_points), 1)
+
+
+def reduce_ohlc(df, key):
+    """Свёртка свечей в OHLC по ключу группы (свечи отсортированы по begin)"""
+    import pandas as pd
+    grouped = df.groupby(key, sort=True)
+    return pd.DataFrame({
+        'open': grouped['open'].first(),
+        'close': grouped['close'].last(),
+        'high': grouped['high'].max(),
+        'low': grouped['low'].min(),
+        'value': grouped['value'].sum(),
+        'volume': grouped['volume'].sum(),
+        'begin': grouped['begin'].first(),
+        'end': grouped['end'].last(),
+    })
+
+
+async def iter_chunks(fetch, ranges, parallel):
+    """Асинхронный генератор частей: не больше parallel загрузок одновременно, части — по мере готовности"""
+    ranges = iter(ranges)
+    pending = set()
+
+    def launch():
+        chunk = next(ranges, None)
+        if chunk is not None:
+            pending.add(asyncio.ensure_future(fetch(*chunk)))
+
+    for _ in range(parallel):
+        launch()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                launch()
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def stream_candles(fetch, interval, start, end, max_points=LINE_MAX_POINTS, parallel=STREAM_PARALLEL, progress=None):
+    """Загружает длинный внутридневной период частями и сворачивает каждую часть в агрегированные свечи.
+
+    В памяти одновременно не больше parallel частей и уже свёрнутый ряд (около max_points точек),
+    сколько бы месяцев минутных свечей ни было в периоде. progress(done, total) вызывается после каждой части.
+    Число исходных свечей сохраняется в attrs['rows'] результата: его показывает заголовок графика.
+    """
+    import pandas as pd
+    ranges = chunk_ranges(interval, start, end)
+    origin = pd.Timestamp(start)
+    bucket = bin_size(interval, start, end, max_points)
+    parts = []
+    rows = 0
+    done = 0
+    if progress is not None:
+        await progress(done, len(ranges))
+    async for df in iter_chunks(fetch, ranges, parallel):
+        if not df.empty:
+            df = df.sort_values('begin')
+            rows += len(df)
+            parts.append(reduce_ohlc(df, ((pd.to_datetime(df['begin']) - origin) // bucket).rename('bin')))
+        done += 1
+        if progress is not None:
+            await progress(done, len(ranges))
+
+    if not parts:
+        return pd.DataFrame(columns=['open', 'close', 'high', 'low', 'value', 'volume', 'begin', 'end'])
+    # Части приходят в произвольном порядке, а группа на стыке частей может быть собрана из двух кусков
+    combined = pd.concat(parts).sort_values('begin')
+    reduced = reduce_ohlc(combined, combined.index).reset_index(drop=True)
+    reduced.attrs['rows'] = rows
+    return reduced
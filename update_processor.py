@@ -0,0 +1,103 @@
+import asyncio
+
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+# Предел семафора базового класса: одновременно обрабатываемые обновления ограничивает PerUserUpdateProcessor.limit
+UNLIMITED = 2**31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений: разные пользователи обслуживаются одновременно,
+    а обновления одного пользователя — строго по очереди, чтобы не путалась история шагов.
+    Инлайн-запросы не трогают историю шагов и идут без очереди: иначе новый запрос ждал бы устаревший.
+
+    collapse_key(update) -> ключ или None: из ожидающих в очереди обновлений с одинаковым ключом
+    выполняется только последнее (повторные нажатия одной и той же дорогой кнопки).
+
+    Общий лимит max_concurrent_updates действует после очереди пользователя: иначе ждущие своей очереди
+    обновления одного пользователя занимали бы общие слоты. Семафор базового класса PTB захватывает ещё до
+    do_process_update (в process_update, которую переопределять нельзя), поэтому ему задан недостижимый предел,
+    а настоящий лимит — собственный семафор. max_concurrent_updates базового класса поэтому не отражает лимит"""
+
+    def __init__(self, max_concurrent_updates, collapse_key=None):
+        if max_concurrent_updates < 1:
+            raise ValueError('max_concurrent_updates должно быть положительным')
+        super().__init__(UNLIMITED)
+        self.limit = max_concurrent_updates
+        self.running = 0
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self.collapse_key = collapse_key
+        self.collapsed = 0
+        self._locks = {}  # id пользователя -> [lock, число ожидающих обновлений]
+        self._latest = {}  # ключ схлопывания -> последнее поступившее обновление
+
+    @staticmethod
+    def _key(update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update) if hasattr(update, 'effective_user') and not getattr(update, 'inline_query', None) else None
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        collapse = self.collapse_key(update) if self.collapse_key else None
+        if collapse is not None:
+            self._latest[collapse] = update
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке поступления
+            async with entry[0]:
+                if collapse is not None:
+                    if self._latest.get(collapse) is not update:
+                        # Пока обновление ждало своей очереди, пришло такое же, но новее: выполнится только оно
+                        await self._answer(update)
+                        coroutine.close()
+                        self.collapsed += 1
+                        return
+                    del self._latest[collapse]
+                # Сначала очередь пользователя и только потом общий слот
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @staticmethod
+    async def _answer(update):
+        """Отвечает на пропущенное нажатие, иначе Telegram показывает у кнопки часики до таймаута"""
+        if update.callback_query is None:
+            return
+        try:
+            await update.callback_query.answer()
+        except TelegramError:
+            pass
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    @property
+    def current_concurrent_updates(self):
+        return self.running
+
+    @property
+    def queued(self):
+        """Обновления, которые ждут завершения предыдущих обновлений того же пользователя"""
+        return sum(count - 1 for _, count in self._locks.values())
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass